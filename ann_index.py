@@ -0,0 +1,189 @@
+import sys, time
+import numpy as np
+
+
+def index_fname(prefix, pos):
+    """ file the Ivf_Index of the synsets of a pos is saved to """
+    return "%s.%s.npz" % (prefix, pos)
+
+def _select(sims, ids, exclude, n):
+    """ the n best (synsetid, sim) of one row of scores, ties going to the larger synsetid like
+        find_similar_synsets, padded with ("000", -1.0) """
+    keep = np.array([sid not in exclude for sid in ids.tolist()], dtype=bool) if exclude else None
+    if keep is not None:
+        sims, ids = sims[keep], ids[keep]
+    if len(sims) > n:
+        kth = -np.partition(-sims, n - 1)[n - 1]
+        best = np.flatnonzero(sims >= kth)
+    else:
+        best = np.arange(len(sims))
+    best = best[np.lexsort((-ids[best], -sims[best]))][:n]
+    found = [(sid, float(sim)) for sid, sim in zip(ids[best].tolist(), sims[best].tolist()) if sim > -1.0]
+    return found + [("000", -1.0)] * (n - len(found))
+
+
+class Ivf_Index:
+    """ Approximate nearest neighbour index over unit synset vectors (inverted file)
+
+    The vectors are clustered with spherical k-means and stored grouped by cluster. A query is
+    only scored against the clusters whose centroids are closest to it, so n_probe trades
+    recall for speed. The vectors of list i are vectors[offsets[i]:offsets[i + 1]].
+
+    Args:
+        ids (np.array of int64): synsetid of each vector, grouped by list
+        vectors (np.array of float32): unit vectors, grouped by list
+        centroids (np.array of float32): unit centroid of each list
+        offsets (np.array of int64): start of each list, has len(centroids) + 1 entries
+    """
+
+    def __init__(self, ids, vectors, centroids, offsets):
+        self.ids = ids
+        self.vectors = vectors
+        self.centroids = centroids
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, ids, vectors, n_lists=None, n_iter=10, seed=0):
+        """ Clusters the vectors into n_lists lists
+
+        Args:
+            ids (np.array of int64): synsetid of each vector
+            vectors (np.array): unit vectors, like the candidate matrix of set_extension.candidate_matrix
+            n_lists (int, optional): number of clusters, sqrt of the number of vectors by default
+            n_iter (int, optional): k-means iterations
+            seed (int, optional): seed for picking the initial centroids
+
+        Returns:
+            Ivf_Index
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+        rs = np.random.RandomState(seed)
+        centroids = vectors[rs.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in xrange(n_iter):
+            assignment = cls._assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            # reseed empty lists with random vectors
+            sums[empty] = vectors[rs.choice(len(vectors), empty.sum())]
+            norms[empty] = 1.0
+            centroids = sums / norms[:, np.newaxis]
+        assignment = cls._assign(vectors, centroids)
+        order = np.argsort(assignment, kind="mergesort")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+        return cls(np.asarray(ids, dtype=np.int64)[order], vectors[order], centroids.astype(np.float32), offsets)
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size=4096):
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in xrange(0, len(vectors), chunk_size):
+            assignment[start:start + chunk_size] = vectors[start:start + chunk_size].dot(centroids.T).argmax(axis=1)
+        return assignment
+
+    @classmethod
+    def load(cls, fname):
+        data = np.load(fname)
+        return cls(data["ids"], data["vectors"], data["centroids"], data["offsets"])
+
+    def save(self, fname):
+        np.savez(fname, ids=self.ids, vectors=self.vectors, centroids=self.centroids, offsets=self.offsets)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, queries, n=15, n_probe=8, exclude=None):
+        """ approximate n most cosine similar synsets of each query
+
+        Args:
+            queries (np.array): one query vector per row
+            n (int, optional): number of results per query
+            n_probe (int, optional): number of lists scored per query
+            exclude (list of set, optional): synsetids to leave out for each query
+
+        Returns:
+            list with a list of (synsetid, sim) per query, best first
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1)
+        norms[norms == 0] = 1.0
+        queries = queries / norms[:, np.newaxis]
+        n_probe = min(n_probe, len(self.centroids))
+        coarse = queries.dot(self.centroids.T)
+        probes = np.argpartition(-coarse, n_probe - 1, axis=1)[:, :n_probe]
+        results = []
+        for q, lists in enumerate(probes):
+            rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+            sims = self.vectors[rows].dot(queries[q])
+            results.append(_select(sims, self.ids[rows], exclude[q] if exclude else None, n))
+        return results
+
+    def exact_search(self, queries, n=15, exclude=None):
+        """ brute force version of search, to measure its recall """
+        queries = np.asarray(queries, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1)
+        norms[norms == 0] = 1.0
+        sims = (queries / norms[:, np.newaxis]).dot(self.vectors.T)
+        return [_select(sims[q], self.ids, exclude[q] if exclude else None, n) for q in xrange(len(queries))]
+
+
+def recall_report(index, queries, n=15, n_probes=(1, 2, 4, 8, 16, 32), exclude=None):
+    """ recall@n of search against exact_search for several n_probe values
+
+    Args:
+        index (Ivf_Index): the index to evaluate
+        queries (np.array): one query vector per row
+
+    Returns:
+        list of (n_probe, recall, seconds) with the exact search as n_probe None
+    """
+    start = time.time()
+    exact = index.exact_search(queries, n, exclude)
+    report = [(None, 1.0, time.time() - start)]
+    truth = [set(sid for sid, _ in row if sid != "000") for row in exact]
+    total = float(max(1, sum(len(t) for t in truth)))
+    for n_probe in n_probes:
+        if n_probe > len(index.centroids):
+            break
+        start = time.time()
+        approx = index.search(queries, n, n_probe, exclude)
+        seconds = time.time() - start
+        hits = sum(len(t & set(sid for sid, _ in row)) for t, row in zip(truth, approx))
+        report.append((n_probe, hits / total, seconds))
+    return report
+
+
+def main(args):
+    """ ann_index.py <wn file> <matrix prefix> <index prefix> [n lists]
+
+    builds and saves an index of the covered synsets of each pos, the candidates learn_new_links
+    searches for that pos, and prints its recall
+    """
+    from synset import get_synsets_by_pos
+    from synset_matrix import Synset_Matrix
+    matrix = Synset_Matrix.load(args[1])
+    n_lists = int(args[3]) if len(args) > 3 else None
+    for pos in ["n", "v", "a", "s"]:
+        rows = set(matrix.row(s.synsetid) for s in get_synsets_by_pos(pos, args[0], lazy=True) if matrix.covers(s.synsetid))
+        rows = np.array(sorted(rows), dtype=np.int64)
+        if len(rows) == 0:
+            continue
+        vectors = np.array(matrix.vectors[rows], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)[:, np.newaxis]
+        start = time.time()
+        index = Ivf_Index.build(matrix.synsetids[rows], vectors, n_lists)
+        print "%s: %d vectors in %d lists built in %.1fs" % (pos, len(index), len(index.centroids), time.time() - start)
+        index.save(index_fname(args[2], pos))
+
+        # queries are synsets of the index, left out of their own results so they do not find themselves
+        picked = np.random.RandomState(1).choice(len(index), min(200, len(index)), replace=False)
+        exclude = [set([sid]) for sid in index.ids[picked].tolist()]
+        for n_probe, recall, seconds in recall_report(index, index.vectors[picked], exclude=exclude):
+            print "  %s recall@15 %.3f in %.3fs" % ("exact" if n_probe is None else "n_probe %d" % n_probe, recall, seconds)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
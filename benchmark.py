@@ -0,0 +1,137 @@
+import sys, os, time, json, random, shutil, tempfile, platform
+import synset
+from synset import get_synsets_by_pos
+from get_links import get_links
+from word_store import convert_word2vec, load_word_vectors
+from set_extension import find_similar_synsets, find_similar_synsets_batched
+from wn_searching import Wn_Searchable
+from wn_fixture import make_fixture
+import wsd_utils
+
+
+class Benchmark_Suite:
+    """ Times the hot paths on a WordNet, word vectors and test cases, made by wn_fixture or real ones
+
+    Every timing is recorded as (name, seconds, operations) so runs of different versions of the
+    code can be compared through the json report
+
+    Args:
+        wn_fname (str): the file name of the sql WordNet
+        bin_fname (str): binary word2vec file of the WordNet's words
+        testcases_fname (str): WsdTester test cases
+        n_queries (int, optional): searches timed per Wn_Searchable method
+        n_cases (int, optional): WsdTester cases, 0 for all
+        seed (int, optional): seed for sampling synsets and cases
+    """
+
+    def __init__(self, wn_fname, bin_fname, testcases_fname, n_queries=200, n_cases=100, seed=0):
+        self.wn_fname = wn_fname
+        self.bin_fname = bin_fname
+        self.testcases_fname = testcases_fname
+        self.n_queries = n_queries
+        self.n_cases = n_cases
+        self.seed = seed
+        self.timings = []
+        self.wsd = None
+
+    def time(self, name, function, n_ops=None):
+        """ runs function once, records and returns its result, n_ops defaults to the length of the result """
+        start = time.time()
+        result = function()
+        seconds = time.time() - start
+        if n_ops is None:
+            n_ops = len(result) if hasattr(result, "__len__") else 1
+        self.timings.append((name, seconds, n_ops))
+        print "%-40s %9.3fs %9d ops %12.1f ops/s" % (name, seconds, n_ops, n_ops / seconds if seconds > 0 else 0)
+        return result
+
+    def run(self):
+        rand = random.Random(self.seed)
+
+        # synset loading, each one from a cold registry
+        for name, kwargs in [("get_synsets_by_pos one by one", dict(bulk=False)),
+                ("get_synsets_by_pos bulk", dict(bulk=True)), ("get_synsets_by_pos lazy", dict(lazy=True))]:
+            synset._REGISTRIES.pop(self.wn_fname, None)
+            self.time(name, lambda: get_synsets_by_pos("n", self.wn_fname, **kwargs))
+        synset._REGISTRIES.pop(self.wn_fname, None)
+        nouns = get_synsets_by_pos("n", self.wn_fname)
+        verbs = get_synsets_by_pos("v", self.wn_fname)
+
+        self.time("get_links hypernym", lambda: get_links("hypernym", self.wn_fname))
+
+        # word vectors, through a Word_Vectors store so gensim is not needed
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            store_fname = os.path.join(tmp_dir, "vectors")
+            self.time("convert_word2vec", lambda: convert_word2vec(self.bin_fname, store_fname), 1)
+            word_vectors = load_word_vectors(store_fname)
+            covered = [s for s in nouns + verbs if s.is_in(word_vectors)]
+            vectors = self.time("Synset.vectorize1", lambda: dict((s.synsetid, s.vectorize1(word_vectors)) for s in covered),
+                    len(covered))
+
+            # the nouns of action links are the references, the verbs the candidates
+            actions = dict()
+            for link in get_links("action", self.wn_fname):
+                actions.setdefault(link.synset1.synsetid, []).append(link.synset2)
+            keys = sorted(actions)[:self.n_queries]
+            references = dict((k, actions[k]) for k in keys)
+            reference_ids = dict((k, set(s.synsetid for s in actions[k])) for k in keys)
+            self.time("find_similar_synsets", lambda: [find_similar_synsets(word_vectors, references[k], reference_ids[k],
+                    verbs, vectors) for k in keys], len(keys))
+            self.time("find_similar_synsets_batched", lambda: find_similar_synsets_batched(word_vectors, references,
+                    reference_ids, verbs, vectors), len(keys))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        # searches on both backends
+        synsetids = [s.synsetid for s in nouns + verbs]
+        pairs = [(rand.choice(synsetids), rand.choice(synsetids)) for _ in xrange(self.n_queries)]
+        sets = [set(rand.sample(synsetids, 20)) for _ in xrange(self.n_queries)]
+        for use_graph in [False, True]:
+            backend = "graph" if use_graph else "sql"
+            wn = self.time("Wn_Searchable %s" % backend, lambda: Wn_Searchable(self.wn_fname, use_graph=use_graph), 1)
+            self.time("get_dist %s" % backend, lambda: [wn.get_dist(s, d) for s, d in pairs], len(pairs))
+            self.time("get_dists %s" % backend, lambda: [wn.get_dists(s, d) for (s, _), d in zip(pairs, sets)], len(pairs))
+            self.time("get_min_dist_to_set %s" % backend,
+                    lambda: [wn.get_min_dist_to_set(s, d) for (s, _), d in zip(pairs, sets)], len(pairs))
+
+        rand_state = wsd_utils.rand.getstate()
+        wsd_utils.rand.seed(self.seed)
+        tester = wsd_utils.WsdTester(self.n_cases, use_graph=True, wn_fname=self.wn_fname,
+                testcases_fname=self.testcases_fname)
+        wsd_utils.rand.setstate(rand_state)
+        self.wsd = self.time("WsdTester.benchmark", lambda: tester.benchmark(wsd_utils.PREDICTORS),
+                len(tester.targets) * len(wsd_utils.PREDICTORS))
+        return self.report()
+
+    def report(self):
+        return {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "wn_file": self.wn_fname,
+            "vectors_file": self.bin_fname,
+            "timings": [{"name": name, "seconds": seconds, "ops": n_ops} for name, seconds, n_ops in self.timings],
+            "wsd": self.wsd,
+        }
+
+
+def main(args):
+    """ benchmark.py <fixture dir> [report.json] [n synsets]
+
+    makes a fixture with wn_fixture in the directory unless it already has one, then runs the suite on it
+    """
+    out_dir = args[0]
+    n_synsets = int(args[2]) if len(args) > 2 else 10000
+    wn_fname = os.path.join(out_dir, "wordnet.db")
+    bin_fname = os.path.join(out_dir, "vectors.bin")
+    testcases_fname = os.path.join(out_dir, "testcases")
+    if not all(os.path.exists(f) for f in [wn_fname, bin_fname, testcases_fname]):
+        print "making a fixture of %d synsets in %s" % (n_synsets, out_dir)
+        make_fixture(out_dir, n_synsets)
+    report = Benchmark_Suite(wn_fname, bin_fname, testcases_fname).run()
+    if len(args) > 1:
+        with open(args[1], "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
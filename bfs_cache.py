@@ -0,0 +1,128 @@
+import sys, os, time
+import cPickle as pickle
+from collections import OrderedDict
+
+
+class Bfs_Layers(object):
+    """ The state of one breadth first search, enough to answer lookups and to resume it
+
+    Args:
+        dists (dict): synsetid -> distance of every synset reached so far
+        frontier (set): synsetids reached at depth, the ones to expand when resuming
+        depth (int): levels expanded so far
+
+    The search has reached every synset connected to its source when frontier is empty
+    """
+    __slots__ = ("dists", "frontier", "depth")
+
+    def __init__(self, dists, frontier, depth=0):
+        self.dists = dists
+        self.frontier = frontier
+        self.depth = depth
+
+
+class Bfs_Cache:
+    """ Bounded LRU cache of the searches run by Wn_Searchable.get_dists and get_min_dist_to_set
+
+    Entries are keyed by (linkids, source synsetid) and hold the Bfs_Layers of the search from that
+    source, in synsetids so they work with both the sql and graph backends. Once the cached synsets
+    exceed max_nodes the least recently used searches are evicted.
+
+    Args:
+        max_nodes (int, optional): maximum number of synsets held over all entries
+        fname (str, optional): file to load the cache from if it exists, and save it to
+
+    Attributes:
+        hits (int): queries answered by lookup alone
+        resumes (int): queries that continued a cached search
+        misses (int): queries that started a new search
+        evictions (int): entries evicted
+    """
+
+    def __init__(self, max_nodes=2000000, fname=None):
+        self.max_nodes = max_nodes
+        self.fname = fname
+        self.entries = OrderedDict()
+        self.n_nodes = 0
+        self.hits = self.resumes = self.misses = self.evictions = 0
+        if fname is not None and os.path.exists(fname):
+            self.load(fname)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """ the Bfs_Layers of key marked as most recently used, None if it is not cached """
+        layers = self.entries.pop(key, None)
+        if layers is not None:
+            self.entries[key] = layers
+        return layers
+
+    def put(self, key, layers):
+        self.discard(key)
+        self.entries[key] = layers
+        self.grew(len(layers.dists))
+
+    def discard(self, key):
+        layers = self.entries.pop(key, None)
+        if layers is not None:
+            self.n_nodes -= len(layers.dists)
+
+    def grew(self, n):
+        """ accounts for n synsets added to the most recently used entry and evicts the least recently used """
+        self.n_nodes += n
+        while self.n_nodes > self.max_nodes and len(self.entries) > 1:
+            _, layers = self.entries.popitem(last=False)
+            self.n_nodes -= len(layers.dists)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.n_nodes = 0
+
+    def stats(self):
+        """ dict of the counters and the current size """
+        return {
+            "hits": self.hits,
+            "resumes": self.resumes,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "nodes": self.n_nodes,
+        }
+
+    def save(self, fname=None):
+        """ Pickles the entries, least recently used first, to fname (or the file the cache was created with) """
+        fname = fname or self.fname
+        tmp_fname = fname + ".tmp"
+        with open(tmp_fname, "wb") as f:
+            pickle.dump([(key, l.dists, l.frontier, l.depth) for key, l in self.entries.iteritems()],
+                    f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_fname, fname)
+
+    def load(self, fname):
+        """ Adds the entries saved in fname, evicting down to max_nodes """
+        with open(fname, "rb") as f:
+            for key, dists, frontier, depth in pickle.load(f):
+                self.put(key, Bfs_Layers(dists, frontier, depth))
+
+
+def main(args):
+    from wn_searching import Wn_Searchable
+    from synset import get_synsets_by_pos
+    wn_fname, cache_fname = args[0], args[1]
+    n = int(args[2]) if len(args) > 2 else 200
+    cache = Bfs_Cache(fname=cache_fname)
+    wn = Wn_Searchable(wn_fname, cache=cache)
+    synsetids = [s.synsetid for s in get_synsets_by_pos("n", wn_fname, lazy=True)[:n]]
+    start = time.time()
+    for src in synsetids:
+        wn.get_dists(src, synsetids[:10])
+    print "%d searches in %.2fs, %s" % (len(synsetids), time.time() - start, cache.stats())
+    cache.save()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,195 @@
+import sys, csv, time
+import numpy as np
+from wn_sql import connect
+from synset import get_registry
+
+
+class Edge_Table:
+    """ The semantic links of any set of link types as numpy arrays
+
+    Edge i links synset1ids[i] to synset2ids[i] and has the link type link_names[types[i]]. Holds
+    what get_links holds as Link objects in a few bytes per link, and computes the Link.dif_vector
+    of every link at once against a Synset_Matrix.
+
+    Args:
+        synset1ids (np.array of int64): synsetid the link goes from
+        synset2ids (np.array of int64): synsetid the link goes to
+        types (np.array of int16): index of each link's type in link_names
+        link_names (list of str): the link types of the table
+    """
+
+    def __init__(self, synset1ids, synset2ids, types, link_names):
+        self.synset1ids = synset1ids
+        self.synset2ids = synset2ids
+        self.types = types
+        self.link_names = list(link_names)
+
+    @classmethod
+    def extract(cls, wn_fname, links=None, batch_size=100000):
+        """ Reads the links of every type in links with one pass over semlinks
+
+        Args:
+            wn_fname (str): the file name of the sql WordNet
+            links (list of str, optional): link types to extract, None for every semantic link type
+            batch_size (int, optional): rows fetched from sqlite at a time
+
+        Returns:
+            Edge_Table with the links in the order sqlite reads them, which may differ from get_links
+        """
+        wn_db = connect(wn_fname).cursor()
+        wn_db.execute("SELECT linkid, link, linktype FROM linktypes ORDER BY linkid")
+        linktypes = wn_db.fetchall()
+        if links is None:
+            links = [link for _, link, linktype in linktypes if linktype != "lex"]
+        linkids = dict((link, (linkid, linktype)) for linkid, link, linktype in linktypes)
+        for link in links:
+            if link not in linkids or linkids[link][1] == "lex":
+                raise Exception("cannot search for %s links" % link)
+
+        # linkid -> index of the link type in links
+        type_of = np.full(max(linkid for linkid, _, _ in linktypes) + 1, -1, dtype=np.int16)
+        for i, link in enumerate(links):
+            type_of[linkids[link][0]] = i
+
+        chunks = []
+        wn_db.execute("SELECT synset1id, synset2id, linkid FROM semlinks WHERE linkid IN (%s)" %
+                ",".join("?" * len(links)), [linkids[link][0] for link in links])
+        while True:
+            batch = wn_db.fetchmany(batch_size)
+            if not batch:
+                break
+            chunks.append(np.array(batch, dtype=np.int64))
+        rows = np.concatenate(chunks) if chunks else np.zeros((0, 3), dtype=np.int64)
+        return cls(rows[:, 0].copy(), rows[:, 1].copy(), type_of[rows[:, 2]], links)
+
+    @classmethod
+    def load(cls, fname):
+        arrays = np.load(fname)
+        return cls(arrays["synset1ids"], arrays["synset2ids"], arrays["types"], arrays["link_names"].tolist())
+
+    def save(self, fname):
+        """ saves the arrays to fname, an .npz file """
+        np.savez(fname, synset1ids=self.synset1ids, synset2ids=self.synset2ids, types=self.types,
+                link_names=np.array(self.link_names))
+
+    def __len__(self):
+        return len(self.synset1ids)
+
+    def type_id(self, link):
+        return self.link_names.index(link)
+
+    def select(self, links):
+        """ the table of the edges of some of the link types, with the same link_names """
+        mask = np.in1d(self.types, [self.type_id(link) for link in links])
+        return Edge_Table(self.synset1ids[mask], self.synset2ids[mask], self.types[mask], self.link_names)
+
+    def rows(self, matrix):
+        """ (synset1 rows, synset2 rows) in a Synset_Matrix, -1 where a synset is not stored """
+        return matrix.rows_of(self.synset1ids), matrix.rows_of(self.synset2ids)
+
+    def covered(self, matrix):
+        """ bool mask of the edges whose synsets both have vectors, where Link.dif_vector is not None """
+        rows1, rows2 = self.rows(matrix)
+        return (rows1 >= 0) & (rows2 >= 0) & matrix.covered[np.maximum(rows1, 0)] & matrix.covered[np.maximum(rows2, 0)]
+
+    def iter_dif_vectors(self, matrix, chunk_size=65536):
+        """ Link.dif_vector of the covered edges, a chunk at a time
+
+        Args:
+            matrix (Synset_Matrix): the synset vectors
+            chunk_size (int, optional): edges per chunk
+
+        Yields:
+            (edge indices, np.array of the difference vectors of those edges)
+        """
+        rows1, rows2 = self.rows(matrix)
+        edges = np.flatnonzero(self.covered(matrix))
+        for start in xrange(0, len(edges), chunk_size):
+            chunk = edges[start:start + chunk_size]
+            yield chunk, np.asarray(matrix.vectors[rows1[chunk]]) - np.asarray(matrix.vectors[rows2[chunk]])
+
+    def dif_vectors(self, matrix):
+        """ (edge indices, difference vectors) of all the covered edges at once """
+        dim = matrix.vectors.shape[1]
+        chunks = list(self.iter_dif_vectors(matrix))
+        if not chunks:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, dim), dtype=np.float32)
+        return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+
+    def average_offsets(self, matrix, chunk_size=65536):
+        """ The mean difference vector of each link type
+
+        Returns:
+            (np.array of one mean per link type, zero for types without covered edges,
+             np.array of the number of covered edges of each type)
+        """
+        n_types = len(self.link_names)
+        sums = np.zeros((n_types, matrix.vectors.shape[1]), dtype=np.float64)
+        counts = np.zeros(n_types, dtype=np.int64)
+        for edges, difs in self.iter_dif_vectors(matrix, chunk_size):
+            types = self.types[edges]
+            # sum the chunk's vectors of each type with one product by the type indicator matrix
+            indicator = (types[np.newaxis, :] == np.arange(n_types)[:, np.newaxis]).astype(np.float32)
+            sums += indicator.dot(difs)
+            counts += np.bincount(types, minlength=n_types)
+        return (sums / np.maximum(counts, 1)[:, np.newaxis]).astype(np.float32), counts
+
+    def iter_rows(self, wn_fname, chunk_size=10000):
+        """ Yields the Link.as_list of every edge, loading the synsets of a chunk of edges at a time
+            from wn_fname's registry and never making Link objects
+        """
+        registry = get_registry(wn_fname)
+        for start in xrange(0, len(self), chunk_size):
+            ids1 = self.synset1ids[start:start + chunk_size].tolist()
+            ids2 = self.synset2ids[start:start + chunk_size].tolist()
+            synsets = registry.get_many(sorted(set(ids1 + ids2)), lazy=True)
+            by_id = dict((s.synsetid, s) for s in synsets)
+            for sid1, sid2 in zip(ids1, ids2):
+                s1, s2 = by_id[sid1], by_id[sid2]
+                yield [sid1, sid2, s1.pos, s2.pos,
+                        " ".join(s1.words).encode('ascii', 'ignore').decode('ascii'),
+                        " ".join(s2.words).encode('ascii', 'ignore').decode('ascii'),
+                        s1.gloss.encode('ascii', 'ignore').decode('ascii'),
+                        s2.gloss.encode('ascii', 'ignore').decode('ascii')]
+
+    def write_csv(self, fname, wn_fname, with_link=False):
+        """ Writes iter_rows as csv, with the link type as a last column if with_link
+
+        Returns:
+            number of rows written
+        """
+        n_rows = 0
+        with open(fname, "wb") as f:
+            writer = csv.writer(f)
+            for i, row in enumerate(self.iter_rows(wn_fname)):
+                if with_link:
+                    row.append(self.link_names[self.types[i]])
+                writer.writerow(row)
+                n_rows += 1
+        return n_rows
+
+
+def main(args):
+    """ edge_table.py <wn file> <out.csv> [matrix prefix] [link types...]
+
+    extracts the links of the given types (all semantic ones by default) and writes them as csv with
+    their link type, with a matrix also prints the length of each type's average offset
+    """
+    from synset_matrix import Synset_Matrix
+    wn_fname, out_fname = args[0], args[1]
+    matrix = Synset_Matrix.load(args[2]) if len(args) > 2 else None
+    start = time.time()
+    edges = Edge_Table.extract(wn_fname, args[3:] or None)
+    print "%d links of %d types extracted in %.2fs" % (len(edges), len(edges.link_names), time.time() - start)
+    if matrix is not None:
+        start = time.time()
+        offsets, counts = edges.average_offsets(matrix)
+        print "average offsets computed in %.2fs" % (time.time() - start)
+        for link, offset, count in zip(edges.link_names, offsets, counts):
+            print "%-24s %8d links %8.4f offset norm" % (link, count, np.linalg.norm(offset))
+    start = time.time()
+    n_rows = edges.write_csv(out_fname, wn_fname, with_link=True)
+    print "%d rows written in %.2fs" % (n_rows, time.time() - start)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,7 +1,7 @@
 
-import sqlite3
 from sqlite3 import Error
-from synset import Synset
+from synset import Synset, get_registry
+from wn_sql import connect
 import sys
 
 
@@ -14,15 +14,22 @@ class Link:
         synsetid1 (int): the synsetid of the second synset in wn_db
         linktyp (str): what kind of link it is
         wn_db (sqlite cursor): a sqlite cursor that can access WordNet information
+        with_gloss (bool, optional): load the glosses of the synsets now, otherwise they are
+            fetched if used (or never, without a registry)
+        registry (Synset_Registry, optional): take the shared synsets from this registry
 
     Attributes:
         linktyp (str): what kind of link it is
         synset1 (Synset): obj of the first synset
         synset2 (Synset): obj of the second synset
     """
-    def __init__(self, synset1id, synset2id, linktyp, wn_db, with_gloss=False):
-        self.synset1 = Synset(synset1id, wn_db, get_glosss=with_gloss)
-        self.synset2 = Synset(synset2id, wn_db, get_glosss=with_gloss)
+    def __init__(self, synset1id, synset2id, linktyp, wn_db, with_gloss=False, registry=None):
+        if registry is not None:
+            self.synset1 = registry.get(synset1id, with_glosses=with_gloss)
+            self.synset2 = registry.get(synset2id, with_glosses=with_gloss)
+        else:
+            self.synset1 = Synset(synset1id, wn_db, get_glosss=with_gloss)
+            self.synset2 = Synset(synset2id, wn_db, get_glosss=with_gloss)
         self.linktyp = linktyp
 
     def __repr__(self):
@@ -53,11 +60,26 @@ def get_links(link, wn_fname, with_glosses=False):
     Attributes
         link (str): the type of link 
         wn_fname (str): the file name of the sql WordNet
+        with_glosses (bool, optional): load the glosses of the synsets with them, otherwise a gloss
+            is only fetched if it is used
 
     Return:
-        list of Links for all the semantic links found
+        list of Links for all the semantic links found, sharing the synsets of wn_fname's registry
     """
-    con = sqlite3.connect(wn_fname)
+    return list(iter_links(link, wn_fname, with_glosses=with_glosses))
+
+def iter_link_ids(link, wn_fname, batch_size=1000):
+    """ streams the (synset1id, synset2id) pairs of the semantic links of typ link
+
+    Attributes
+        link (str): the type of link 
+        wn_fname (str): the file name of the sql WordNet
+        batch_size (int, optional): rows fetched from sqlite at a time
+
+    Yield:
+        lists of up to batch_size (synset1id, synset2id) pairs
+    """
+    con = connect(wn_fname)
     wn_db = con.cursor()
     
     # get linkid
@@ -70,20 +92,39 @@ def get_links(link, wn_fname, with_glosses=False):
 
     # search for all links
     wn_db.execute("SELECT synset1id, synset2id FROM semlinks WHERE linkid=?", (linkid,))
-    linked_synsetids = wn_db.fetchall()
-    linked_wordlists = [Link(snid1, snid2, link, wn_db, with_gloss=with_glosses) for snid1, snid2 in linked_synsetids]
+    while True:
+        batch = wn_db.fetchmany(batch_size)
+        if not batch:
+            break
+        yield batch
 
-    return linked_wordlists
-    
+def iter_links(link, wn_fname, batch_size=1000, with_glosses=False):
+    """ streams the semantic links of typ link as Links, loading their synsets a batch at a time
 
+    Attributes
+        link (str): the type of link 
+        wn_fname (str): the file name of the sql WordNet
+        batch_size (int, optional): rows fetched from sqlite at a time
+        with_glosses (bool, optional): load the glosses of the synsets with them
+
+    Yield:
+        Links sharing the synsets of wn_fname's registry
+    """
+    registry = get_registry(wn_fname)
+    for batch in iter_link_ids(link, wn_fname, batch_size):
+        registry.get_many([snid for pair in batch for snid in pair], with_glosses=with_glosses)
+        for snid1, snid2 in batch:
+            yield Link(snid1, snid2, link, registry.wn_db, with_gloss=with_glosses, registry=registry)
+    
 
 def main(args):
     link = args[0]
     wn_fname = args[1]
-    links = get_links(link, wn_fname)
-    for link in links:
+    n_links = 0
+    for link in iter_links(link, wn_fname):
         print link
-    print "%d links found" % len(links)
+        n_links += 1
+    print "%d links found" % n_links
 
 if __name__ == "__main__":
     args = sys.argv[1:]
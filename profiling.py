@@ -0,0 +1,319 @@
+import sys, os, re, time, json, inspect, sqlite3
+from functools import wraps
+
+PROFILE_ENV = "WN_PROFILE" # json file to write the profile to, setting it turns profiling on
+
+# (module, class or None, function, attribute counted by the call) of the timed hot paths
+HOT_PATHS = [
+    ("synset", "Synset", "__init__", None),
+    ("synset", "Synset", "_load", None),
+    ("synset", "Synset", "vectorize1", None),
+    ("synset", "Synset_Registry", "resolve", None),
+    ("synset", "Synset_Registry", "get_many", None),
+    ("synset", "Synset_Registry", "by_pos", None),
+    ("wn_searching", "Wn_Searchable", "get_synsetids", None),
+    ("wn_searching", "Wn_Searchable", "get_senses", None),
+    ("wn_searching", "Wn_Searchable", "get_dist", "n_expanded"),
+    ("wn_searching", "Wn_Searchable", "get_dists", "n_expanded"),
+    ("wn_searching", "Wn_Searchable", "get_min_dist_to_set", "n_expanded"),
+    ("wn_searching", "Wn_Searchable", "get_dists_multi", "n_expanded"),
+    ("wn_searching", "Wn_Searchable", "get_min_dists_to_set", "n_expanded"),
+    ("wn_searching", "Wn_Searchable", "get_graph", None),
+    ("set_extension", None, "candidate_matrix", None),
+    ("set_extension", None, "iter_top_n", None),
+    ("set_extension", None, "iter_top_n_parallel", None),
+    ("set_extension", None, "find_similar_synsets", None),
+    ("set_extension", None, "find_similar_synsets_batched", None),
+    ("set_extension", None, "iter_similar_synsets_batched", None),
+    ("similarity_extension", None, "unit_vectors", None),
+    ("similarity_extension", None, "score_pairs", None),
+    ("similarity_extension", None, "top_pairs", None),
+    ("similarity_extension", None, "top_pairs_rescored", None),
+]
+
+_SKIPPED_FILES = ("profiling.py", "wn_sql.py") # frames that are not call sites of a query
+
+_profiler = [] # the running Profiler, if any
+
+
+class Profiler:
+    """ Counters and timers of one run
+
+    Attributes:
+        timers (dict): name -> [calls, seconds], seconds include the time spent in nested timers
+        counters (dict): name -> count
+        sql (dict): (statement, call site) -> [executions, rows fetched, seconds executing and fetching]
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.timers = dict()
+        self.counters = dict()
+        self.sql = dict()
+        self.patched = [] # (owner, name, original) to restore
+
+    def add(self, name, seconds, calls=1):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = [0, 0.0]
+        timer[0] += calls
+        timer[1] += seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_query(self, key, seconds, rows=0, executions=0):
+        stats = self.sql.get(key)
+        if stats is None:
+            stats = self.sql[key] = [0, 0, 0.0]
+        stats[0] += executions
+        stats[1] += rows
+        stats[2] += seconds
+
+    def profile(self):
+        """ the profile as a json serializable dict, longest first """
+        return {
+            "wall_seconds": time.time() - self.start,
+            "timers": [{"name": name, "calls": calls, "seconds": seconds} for name, (calls, seconds)
+                    in sorted(self.timers.iteritems(), key=lambda item: -item[1][1])],
+            "counters": self.counters,
+            "sql": [{"statement": statement, "site": site, "executions": executions, "rows": rows, "seconds": seconds}
+                    for (statement, site), (executions, rows, seconds) in sorted(self.sql.iteritems(), key=lambda item: -item[1][2])],
+        }
+
+    def summary(self, n_rows=25):
+        """ the profile as a table of the n_rows slowest timers and statements """
+        profile = self.profile()
+        wall = profile["wall_seconds"] or 1.0
+        lines = ["%-48s %10s %10s %10s %7s" % ("timer", "calls", "seconds", "mean ms", "% wall")]
+        for t in profile["timers"][:n_rows]:
+            lines.append("%-48s %10d %10.3f %10.3f %6.1f%%" % (t["name"][:48], t["calls"], t["seconds"],
+                    1000 * t["seconds"] / max(1, t["calls"]), 100 * t["seconds"] / wall))
+        if profile["counters"]:
+            lines.append("")
+            lines.append("%-48s %10s" % ("counter", "count"))
+            for name in sorted(profile["counters"]):
+                lines.append("%-48s %10d" % (name[:48], profile["counters"][name]))
+        lines.append("")
+        lines.append("%-56s %-40s %9s %10s %9s" % ("statement", "call site", "queries", "rows", "seconds"))
+        for q in profile["sql"][:n_rows]:
+            lines.append("%-56s %-40s %9d %10d %9.3f" % (q["statement"][:56], q["site"][-40:], q["executions"],
+                    q["rows"], q["seconds"]))
+        lines.append("")
+        lines.append("%d queries, %.3fs in sql, %.3fs wall" % (sum(q["executions"] for q in profile["sql"]),
+                sum(q["seconds"] for q in profile["sql"]), wall))
+        return "\n".join(lines)
+
+
+def get_profiler():
+    """ the running Profiler, None when profiling is off """
+    return _profiler[0] if _profiler else None
+
+def is_enabled():
+    return bool(_profiler)
+
+class _Null_Timer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _Null_Timer()
+
+class _Timer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.time() - self.start)
+        return False
+
+def timer(name):
+    """ context manager timing a block under name, does nothing when profiling is off """
+    if not _profiler:
+        return _NULL_TIMER
+    return _Timer(_profiler[0], name)
+
+
+_IN_LIST = re.compile(r"\(\s*\?(\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+_statements = dict() # sql -> normalized statement
+
+def _statement(sql):
+    """ sql with its whitespace collapsed and IN lists of any length written (?...), so chunked queries add up """
+    statement = _statements.get(sql)
+    if statement is None:
+        statement = _statements[sql] = _IN_LIST.sub("(?...)", _SPACE.sub(" ", sql).strip())
+    return statement
+
+def _call_site():
+    """ file:line function of the code that ran the query """
+    frame = sys._getframe(2)
+    while frame is not None and os.path.basename(frame.f_code.co_filename) in _SKIPPED_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    return "%s:%d %s" % (os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+
+class Profiled_Cursor(sqlite3.Cursor):
+    """ sqlite cursor recording every statement it executes, by statement and call site
+
+    Fetches are added to the last statement executed. Rows read by iterating over the cursor are
+    not counted, their time goes to the caller.
+    """
+
+    def execute(self, sql, *args):
+        self._key = (_statement(sql), _call_site())
+        start = time.time()
+        sqlite3.Cursor.execute(self, sql, *args)
+        if _profiler:
+            _profiler[0].add_query(self._key, time.time() - start, executions=1)
+        return self
+
+    def executemany(self, sql, *args):
+        self._key = (_statement(sql), _call_site())
+        start = time.time()
+        sqlite3.Cursor.executemany(self, sql, *args)
+        if _profiler:
+            _profiler[0].add_query(self._key, time.time() - start, executions=1)
+        return self
+
+    def _fetched(self, rows, start):
+        key = getattr(self, "_key", None)
+        if key is not None and _profiler:
+            _profiler[0].add_query(key, time.time() - start, len(rows))
+        return rows
+
+    def fetchone(self):
+        start = time.time()
+        row = sqlite3.Cursor.fetchone(self)
+        self._fetched([row] if row is not None else [], start)
+        return row
+
+    def fetchmany(self, *args):
+        start = time.time()
+        return self._fetched(sqlite3.Cursor.fetchmany(self, *args), start)
+
+    def fetchall(self):
+        start = time.time()
+        return self._fetched(sqlite3.Cursor.fetchall(self), start)
+
+class Profiled_Connection(sqlite3.Connection):
+    """ sqlite connection whose cursors, and shortcut executes, are Profiled_Cursors """
+
+    def cursor(self, factory=Profiled_Cursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+def connection_factory():
+    """ the factory wn_sql.connect opens connections with """
+    return Profiled_Connection if _profiler else sqlite3.Connection
+
+
+def _timed(function, name, count_attr=None):
+    """ function wrapped to add its calls to the timer name, generators are timed while they run """
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def timed_generator(*args, **kwargs):
+            profiler = _profiler[0]
+            start = time.time()
+            seconds = 0.0
+            try:
+                for item in function(*args, **kwargs):
+                    seconds += time.time() - start
+                    yield item
+                    start = time.time()
+                seconds += time.time() - start
+            finally:
+                profiler.add(name, seconds)
+        return timed_generator
+
+    @wraps(function)
+    def timed(*args, **kwargs):
+        profiler = _profiler[0]
+        before = getattr(args[0], count_attr) if count_attr else 0
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.add(name, time.time() - start)
+            if count_attr:
+                profiler.count("%s %s" % (name, count_attr), getattr(args[0], count_attr) - before)
+    return timed
+
+def _loaded_module(name):
+    """ the module if it has been imported, also when it runs as the script """
+    module = sys.modules.get(name)
+    if module is None:
+        main = sys.modules.get("__main__")
+        fname = getattr(main, "__file__", None)
+        if fname and os.path.splitext(os.path.basename(fname))[0] == name:
+            module = main
+    return module
+
+def enable(hot_paths=HOT_PATHS):
+    """ Starts profiling: connections opened from now on record their queries and the hot paths are timed
+
+    Nothing is patched or wrapped until this is called, so a run without profiling pays nothing
+    more than a check in wn_sql.connect. Only the hot paths of modules that are already imported
+    are timed, and code that imported a hot path function by name keeps calling the untimed one.
+    Open the WordNet after enabling, connections that are already open are not profiled. Worker
+    processes do not add to the profile of the parent.
+
+    Returns:
+        Profiler
+    """
+    if _profiler:
+        return _profiler[0]
+    profiler = Profiler()
+    _profiler.append(profiler)
+    for module_name, class_name, name, count_attr in hot_paths:
+        module = _loaded_module(module_name)
+        if module is None:
+            continue
+        owner = getattr(module, class_name) if class_name else module
+        original = owner.__dict__[name]
+        label = "%s.%s" % (class_name or module_name, name)
+        setattr(owner, name, _timed(original, label, count_attr))
+        profiler.patched.append((owner, name, original))
+    return profiler
+
+def disable():
+    """ Stops profiling and restores the hot paths
+
+    Returns:
+        the Profiler that was running, or None
+    """
+    if not _profiler:
+        return None
+    profiler = _profiler.pop()
+    for owner, name, original in reversed(profiler.patched):
+        setattr(owner, name, original)
+    profiler.patched = []
+    return profiler
+
+def enable_from_env():
+    """ enables profiling if WN_PROFILE is set """
+    if os.environ.get(PROFILE_ENV):
+        return enable()
+
+def finish(out_fname=None):
+    """ Stops profiling, prints the summary table and writes the json profile
+
+    Args:
+        out_fname (str, optional): json file to write, defaults to WN_PROFILE
+    """
+    profiler = disable()
+    if profiler is None:
+        return None
+    out_fname = out_fname or os.environ.get(PROFILE_ENV)
+    print profiler.summary()
+    if out_fname:
+        with open(out_fname, "w") as f:
+            json.dump(profiler.profile(), f, indent=2, sort_keys=True)
+    return profiler
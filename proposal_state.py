@@ -0,0 +1,245 @@
+import sys, os, time
+import cPickle as pickle
+import numpy as np
+from get_links import iter_link_ids
+from synset import get_registry, get_synsets_by_pos
+from word_store import load_word_vectors
+from set_extension import candidate_matrix, iter_top_n
+
+DIRECTIONS = ["to", "from"]
+
+
+def state_fname(prefix, link, pos_from, pos_to):
+    """ file the Proposal_State of a link type and pos pair is saved to """
+    return "%s.%s.%s-%s.state" % (prefix, link.replace(" ", "_"), pos_from, pos_to)
+
+class Proposal_State:
+    """ The proposals of learn_new_links for one link type and pos pair, kept up to date as links change
+
+    Holds what learn_new_links computes on every run: the synset vectors, the candidate matrices,
+    the reference groups (links_to / links_from) with their sets of excluded synsetids, and the
+    top n of every group. When links are added or removed only the groups they belong to are
+    marked dirty, and recompute scores just those rows, so the proposals stay the same as a full
+    batched exact run of learn_new_links over the current links (up to float32 rounding, which
+    depends on which rows are multiplied together).
+
+    The candidates are fixed when the state is built, rebuild it if the synsets change.
+
+    Args:
+        link (str): the type of link
+        pos_from (str): pos of the synsets links go from
+        pos_to (str): pos of the synsets links go to
+        n (int, optional): proposals kept per synset
+
+    Attributes:
+        vectors (dict): synsetid -> vectorize1 vector of every synset known to have one
+        uncovered (set): synsetids known to have no vector, links to them are left out
+        pairs (dict): (synset1id, synset2id) -> count of the links applied so far
+        references (dict): direction -> synsetid -> synsetids of its links, in link order
+        excluded (dict): direction -> synsetid -> set of synsetids it links to, left out of its proposals
+        candidates (dict): direction -> (synsetids, unit vectors) from set_extension.candidate_matrix
+        proposals (dict): direction -> synsetid -> list of (synsetid, sim)
+        dirty (dict): direction -> synsetids whose proposals are out of date
+    """
+
+    def __init__(self, link, pos_from, pos_to, n=15):
+        self.link = link
+        self.pos_from = pos_from
+        self.pos_to = pos_to
+        self.n = n
+        self.vectors = dict()
+        self.uncovered = set()
+        self.pairs = dict()
+        self.references = dict((d, dict()) for d in DIRECTIONS)
+        self.excluded = dict((d, dict()) for d in DIRECTIONS)
+        self.candidates = dict()
+        self.proposals = dict((d, dict()) for d in DIRECTIONS)
+        self.dirty = dict((d, set()) for d in DIRECTIONS)
+
+    @classmethod
+    def build(cls, link, pos_from, pos_to, wn_fname, word_vectors, n=15):
+        """ Vectorizes the synsets of both pos, applies every link of the type and computes all the proposals
+
+        Args:
+            wn_fname (str): the file name of the sql WordNet
+            word_vectors (gensim.KeyedVectors, Word_Vectors, Synset_Matrix): vectors to use
+
+        Returns:
+            Proposal_State
+        """
+        state = cls(link, pos_from, pos_to, n)
+        possible_to = get_synsets_by_pos(pos_to, wn_fname, lazy=True)
+        possible_from = get_synsets_by_pos(pos_from, wn_fname, lazy=True)
+        state._cover(possible_to + possible_from, word_vectors)
+        state.candidates["to"] = candidate_matrix(possible_to, state.vectors)
+        state.candidates["from"] = candidate_matrix(possible_from, state.vectors)
+        for batch in iter_link_ids(link, wn_fname):
+            state.add(batch, wn_fname, word_vectors)
+        state.recompute()
+        return state
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, fname):
+        tmp_fname = fname + ".tmp"
+        with open(tmp_fname, "wb") as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_fname, fname)
+
+    def _cover(self, synsets, word_vectors):
+        for synset in synsets:
+            if synset.synsetid in self.vectors or synset.synsetid in self.uncovered:
+                continue
+            if synset.is_in(word_vectors):
+                self.vectors[synset.synsetid] = synset.vectorize1(word_vectors)
+            else:
+                self.uncovered.add(synset.synsetid)
+
+    def _covered(self, pairs, wn_fname, word_vectors):
+        """ the pairs whose synsets both have vectors, vectorizing synsets not seen before """
+        unknown = set(sid for pair in pairs for sid in pair if sid not in self.vectors and sid not in self.uncovered)
+        if unknown:
+            if word_vectors is None or wn_fname is None:
+                raise Exception("%d synsets have not been vectorized, pass wn_fname and word_vectors" % len(unknown))
+            self._cover(get_registry(wn_fname).get_many(sorted(unknown)), word_vectors)
+        return [(s1, s2) for s1, s2 in pairs if s1 in self.vectors and s2 in self.vectors]
+
+    def add(self, pairs, wn_fname=None, word_vectors=None):
+        """ Adds links and marks the groups of their synsets dirty
+
+        Args:
+            pairs (list of tuple): (synset1id, synset2id) of the new links
+            wn_fname (str, optional): WordNet to load synsets from, only needed for synsets not seen before
+            word_vectors (optional): vectors for synsets not seen before
+        """
+        for pair in pairs:
+            self.pairs[pair] = self.pairs.get(pair, 0) + 1
+        for s1, s2 in self._covered(pairs, wn_fname, word_vectors):
+            for direction, key, other in [("to", s1, s2), ("from", s2, s1)]:
+                self.references[direction].setdefault(key, []).append(other)
+                self.excluded[direction].setdefault(key, set()).add(other)
+                self.dirty[direction].add(key)
+
+    def remove(self, pairs):
+        """ Removes links (one of each pair) and marks the groups of their synsets dirty """
+        removed = []
+        for pair in pairs:
+            count = self.pairs.get(pair, 0)
+            if count == 0:
+                continue
+            if count == 1:
+                del self.pairs[pair]
+            else:
+                self.pairs[pair] = count - 1
+            removed.append(pair)
+        for s1, s2 in removed:
+            if s1 not in self.vectors or s2 not in self.vectors:
+                continue
+            for direction, key, other in [("to", s1, s2), ("from", s2, s1)]:
+                references = self.references[direction][key]
+                references.remove(other)
+                if not references:
+                    del self.references[direction][key]
+                    del self.excluded[direction][key]
+                elif other not in references:
+                    self.excluded[direction][key].discard(other)
+                self.dirty[direction].add(key)
+
+    def sync(self, pairs, wn_fname=None, word_vectors=None):
+        """ Adds and removes links so the state holds exactly pairs, like the current links of the WordNet
+
+        Returns:
+            (number of links added, number of links removed)
+        """
+        current = dict()
+        for pair in pairs:
+            current[pair] = current.get(pair, 0) + 1
+        added = [pair for pair, count in current.iteritems() for _ in xrange(count - self.pairs.get(pair, 0))]
+        removed = [pair for pair, count in self.pairs.iteritems() for _ in xrange(count - current.get(pair, 0))]
+        self.remove(removed)
+        self.add(added, wn_fname, word_vectors)
+
+        # put the changed groups in the order of pairs, so their averages are summed in the same order
+        # as a full run over the same links
+        for direction, k, o in [("to", 0, 1), ("from", 1, 0)]:
+            dirty = self.dirty[direction]
+            ordered = dict()
+            for pair in pairs:
+                if pair[k] in dirty and pair[0] in self.vectors and pair[1] in self.vectors:
+                    ordered.setdefault(pair[k], []).append(pair[o])
+            self.references[direction].update(ordered)
+        return len(added), len(removed)
+
+    def recompute(self):
+        """ Scores the dirty groups again
+
+        Returns:
+            number of groups recomputed
+        """
+        n_recomputed = 0
+        for direction in DIRECTIONS:
+            proposals = self.proposals[direction]
+            keys = []
+            for key in sorted(self.dirty[direction]):
+                if key in self.references[direction]:
+                    keys.append(key)
+                else:
+                    proposals.pop(key, None)
+            self.dirty[direction].clear()
+            if not keys:
+                continue
+            candidate_ids, candidates = self.candidates[direction]
+            if len(candidate_ids) == 0:
+                for key in keys:
+                    proposals[key] = [("000", -1.0)] * self.n
+                continue
+            # averaged like set_extension.iter_similar_synsets_batched so the scores match
+            reference_vectors = np.array([sum(self.vectors[sid] for sid in self.references[direction][key]) /
+                    float(len(self.references[direction][key])) for key in keys])
+            exclude = [self.excluded[direction][key] for key in keys]
+            for key, row in zip(keys, iter_top_n(reference_vectors, exclude, candidate_ids, candidates, self.n)):
+                proposals[key] = row
+            n_recomputed += len(keys)
+        return n_recomputed
+
+    def iter_proposals(self):
+        """ yields the proposals like set_extension.iter_new_links, ("to", s1id, list of (s2id, sim)) then "from" """
+        for direction in DIRECTIONS:
+            for key in sorted(self.proposals[direction]):
+                yield direction, key, self.proposals[direction][key]
+
+
+def main(args):
+    """ proposal_state.py <link> <pos_from> <pos_to> <wn file> <vectors> <state prefix> <out>
+
+    builds the state the first time, later runs only recompute the groups whose links changed
+    """
+    link, pos_from, pos_to, wn_fname, vectors_fname, prefix, out_fname = args[:7]
+    fname = state_fname(prefix, link, pos_from, pos_to)
+    word_vectors = load_word_vectors(vectors_fname)
+    start = time.time()
+    if os.path.exists(fname):
+        state = Proposal_State.load(fname)
+        pairs = [pair for batch in iter_link_ids(link, wn_fname) for pair in batch]
+        added, removed = state.sync(pairs, wn_fname, word_vectors)
+        n_recomputed = state.recompute()
+        print "%d links added, %d removed, %d groups recomputed in %.3fs" % (added, removed, n_recomputed, time.time() - start)
+    else:
+        state = Proposal_State.build(link, pos_from, pos_to, wn_fname, word_vectors)
+        print "state built in %.1fs" % (time.time() - start)
+    state.save(fname)
+
+    output = open(out_fname, "wb")
+    for direction, synsetid, found in state.iter_proposals():
+        for other_id, sim in found:
+            if direction == "to":
+                output.write("%s,%s,%f\n" %(synsetid, other_id, sim))
+            else:
+                output.write("%s,%s,%f\n" %(other_id, synsetid, sim))
+    output.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,212 @@
+import sys, time
+import numpy as np
+from ann_index import _select
+
+KINDS = ["float16", "int8"]
+
+
+class Quantized_Matrix:
+    """ A float matrix stored as float16, or as int8 with one float32 scale per row
+
+    Rows are dequantized a chunk at a time when scored, so a scan reads a half (float16) or a
+    quarter (int8) of the bytes of the float32 matrix. Saved like Synset_Matrix as .npy files
+    that are memory mapped when loaded:
+        <fname>.<kind>.npy         the codes
+        <fname>.<kind>.scales.npy  float32 scale of each row (int8 only)
+
+    Args:
+        codes (np.array of float16 or int8): one row per vector
+        scales (np.array of float32): row i is codes[i] * scales[i], None for float16
+    """
+
+    def __init__(self, codes, scales=None):
+        self.codes = codes
+        self.scales = scales
+        self.kind = "int8" if codes.dtype == np.int8 else "float16"
+
+    @classmethod
+    def quantize(cls, vectors, kind="int8"):
+        """ Quantizes the rows of vectors
+
+        Args:
+            vectors (np.array): one vector per row
+            kind (str, optional): "float16" or "int8"
+
+        Returns:
+            Quantized_Matrix
+        """
+        if kind not in KINDS:
+            raise Exception("no such kind: %s, must be in {%s}" % (kind, ", ".join(KINDS)))
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if kind == "float16":
+            return cls(vectors.astype(np.float16))
+        scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.zeros(0, dtype=np.float32)
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, np.newaxis]).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    @classmethod
+    def load(cls, fname, kind="int8", mmap=True):
+        mode = "r" if mmap else None
+        codes = np.load("%s.%s.npy" % (fname, kind), mmap_mode=mode)
+        scales = np.load("%s.%s.scales.npy" % (fname, kind)) if kind == "int8" else None
+        return cls(codes, scales)
+
+    def save(self, fname):
+        np.save("%s.%s.npy" % (fname, self.kind), self.codes)
+        if self.scales is not None:
+            np.save("%s.%s.scales.npy" % (fname, self.kind), self.scales)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        """ size of the codes and scales in bytes """
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def rows(self, start, stop):
+        """ rows start to stop dequantized to float32 """
+        block = np.asarray(self.codes[start:stop], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:stop, np.newaxis]
+        return block
+
+    def take(self, rows):
+        """ the rows at an array of row numbers dequantized to float32 """
+        block = np.asarray(self.codes[rows], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows, np.newaxis]
+        return block
+
+    def select(self, rows):
+        """ a Quantized_Matrix of some of the rows, still quantized, like the candidates of one pos
+            picked out of a store saved for every row of a Synset_Matrix """
+        return Quantized_Matrix(np.array(self.codes[rows]), self.scales[rows] if self.scales is not None else None)
+
+    def dot(self, queries, chunk_size=8192):
+        """ approximate queries.dot(vectors.T), one row of scores per query """
+        queries = np.asarray(queries, dtype=np.float32)
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in xrange(0, len(self.codes), chunk_size):
+            scores[:, start:start + chunk_size] = queries.dot(self.rows(start, start + chunk_size).T)
+        return scores
+
+
+def iter_top_n_rescored(reference_vectors, reference_id_sets, candidate_ids, candidates, quantized, n=15,
+        oversample=4, chunk_size=1024, candidate_rows=None):
+    """ set_extension.iter_top_n with the scan done on quantized candidates
+
+    The n * oversample best candidates of each row by their quantized scores are rescored with the
+    float32 candidates, so the sims are exact and the top n only differs from iter_top_n when a
+    true top n candidate fell out of the shortlist. Only the shortlisted float32 rows are read, and
+    normalized like set_extension.candidate_matrix does, so candidates can be the memory mapped
+    vectors of a Synset_Matrix.
+
+    Args:
+        candidates (np.array): float32 vectors holding the candidates
+        quantized (Quantized_Matrix): the quantized candidates, one row per candidate
+        oversample (int, optional): shortlist size as a multiple of n
+        candidate_rows (np.array, optional): row of candidates holding each candidate, None if
+            candidates has one row per candidate
+        (other args as in set_extension.iter_top_n)
+
+    Yields:
+        list of (synsetid, sim) per row, best first and padded to n
+    """
+    column = dict((sid, j) for j, sid in enumerate(candidate_ids.tolist()))
+    shortlist = min(n * oversample, len(candidate_ids))
+    row = np.empty(len(candidate_ids), dtype=np.float32)
+    for start in xrange(0, len(reference_vectors), chunk_size):
+        chunk = np.asarray(reference_vectors[start:start + chunk_size], dtype=np.float32)
+        norms = np.linalg.norm(chunk, axis=1)
+        norms[norms == 0] = 1.0
+        chunk = chunk / norms[:, np.newaxis]
+        approx = quantized.dot(chunk)
+        for r, ref_ids in enumerate(reference_id_sets[start:start + chunk_size]):
+            masked = [column[sid] for sid in ref_ids if sid in column]
+            approx[r, masked] = -np.inf
+            # shortlist one row at a time, so no copy of the whole chunk of scores is made
+            np.negative(approx[r], out=row)
+            best = np.argpartition(row, shortlist - 1)[:shortlist]
+            best = best[approx[r, best] > -np.inf]
+            source = candidate_rows[best] if candidate_rows is not None else best
+            vectors = np.asarray(candidates[source], dtype=np.float32)
+            vector_norms = np.linalg.norm(vectors, axis=1)
+            vector_norms[vector_norms == 0] = 1.0
+            sims = (vectors / vector_norms[:, np.newaxis]).dot(chunk[r])
+            yield _select(sims, candidate_ids[best], None, n)
+
+def agreement(found, truth):
+    """ (share of the true top n found, share of rows with exactly the true top n) of two lists of top n rows """
+    hits = total = same = 0
+    for row, true_row in zip(found, truth):
+        true_ids = [sid for sid, _ in true_row if sid != "000"]
+        ids = [sid for sid, _ in row if sid != "000"]
+        hits += len(set(ids) & set(true_ids))
+        total += len(true_ids)
+        same += ids == true_ids
+    return hits / float(max(1, total)), same / float(max(1, len(truth)))
+
+def quantization_report(candidate_ids, candidates, queries, n=15, oversample=4):
+    """ Memory, time and top n agreement of each kind against the float32 scan
+
+    Args:
+        candidate_ids (np.array): synsetid of each candidate
+        candidates (np.array): unit candidate vectors
+        queries (np.array): one query vector per row
+
+    Returns:
+        list of dicts, the first for float32
+    """
+    from set_extension import top_n
+    exclude = [set() for _ in queries]
+    start = time.time()
+    truth = top_n(queries, exclude, candidate_ids, candidates, n)
+    exact_seconds = time.time() - start
+    report = [{"kind": "float32", "bytes": np.asarray(candidates, dtype=np.float32).nbytes, "seconds": exact_seconds,
+            "recall": 1.0, "same_top_n": 1.0}]
+    for kind in KINDS:
+        quantized = Quantized_Matrix.quantize(candidates, kind)
+        # ranking by the quantized scores alone, before rescoring
+        unit = queries / np.maximum(np.linalg.norm(queries, axis=1), 1e-12)[:, np.newaxis]
+        approx = quantized.dot(unit)
+        raw = [_select(row, candidate_ids, None, n) for row in approx]
+        start = time.time()
+        rescored = list(iter_top_n_rescored(queries, exclude, candidate_ids, candidates, quantized, n, oversample))
+        seconds = time.time() - start
+        recall, same = agreement(rescored, truth)
+        raw_recall, _ = agreement(raw, truth)
+        report.append({"kind": kind, "bytes": quantized.nbytes, "seconds": seconds, "recall": recall,
+                "same_top_n": same, "recall_before_rescoring": raw_recall})
+    return report
+
+
+def main(args):
+    """ quantized.py <matrix prefix> [n queries]
+
+    quantizes a saved Synset_Matrix to both kinds, saves them next to it and prints the report
+    """
+    from synset_matrix import Synset_Matrix
+    matrix = Synset_Matrix.load(args[0])
+    n_queries = int(args[1]) if len(args) > 1 else 500
+    # unit rows, row i of the quantized files stays the vector of matrix.synsetids[i]
+    vectors = np.array(matrix.vectors, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)[:, np.newaxis]
+    for kind in KINDS:
+        Quantized_Matrix.quantize(vectors, kind).save(args[0])
+
+    covered = np.flatnonzero(matrix.covered)
+    ids, vectors = matrix.synsetids[covered], vectors[covered]
+    queries = vectors[np.random.RandomState(1).choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    report = quantization_report(ids, vectors, queries)
+    exact = report[0]
+    print "%-8s %10s %8s %9s %8s %8s %10s %12s" % ("kind", "KB", "saved", "seconds", "speedup", "recall",
+            "same top n", "raw recall")
+    for row in report:
+        print "%-8s %10.1f %7.1f%% %9.3f %7.2fx %8.4f %10.4f %12.4f" % (row["kind"], row["bytes"] / 1024.0,
+                100.0 * (1 - float(row["bytes"]) / exact["bytes"]), row["seconds"], exact["seconds"] / row["seconds"],
+                row["recall"], row["same_top_n"], row.get("recall_before_rescoring", 1.0))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,7 +1,12 @@
-import gensim, sys, string, heapq, math
-from get_links import Link, get_links
+import sys, string, heapq, math, os, shutil, tempfile, multiprocessing
+from get_links import Link, iter_links
 from synset import Synset, get_synsets_by_pos
+from word_store import load_word_vectors
+from synset_matrix import Synset_Matrix
+from ann_index import Ivf_Index, index_fname
+from quantized import Quantized_Matrix, iter_top_n_rescored
 import numpy as np
+import profiling
 
 def cosine_similarity(v1, v2):
     """ returns the cosine similarity of 2 vectors 
@@ -34,30 +39,266 @@ def find_similar_synsets(word_vectors, reference, reference_id_set, possibilitie
             _ = heapq.heappushpop(nbest, (cos, possibility.synsetid))
 
     return [(sid, sim) for sim, sid in nbest]
+
+def candidate_ids(possibilities, has_vector):
+    """ the synsetids of the possibilities for which has_vector(synsetid) is true, once each and in order
+
+    Returns:
+        np.array of int64
+    """
+    ids = []
+    seen = set()
+    for possibility in possibilities:
+        if possibility.synsetid not in seen and has_vector(possibility.synsetid):
+            seen.add(possibility.synsetid)
+            ids.append(possibility.synsetid)
+    return np.array(ids, dtype=np.int64)
+
+def candidate_matrix(possibilities, vector_dict):
+    """ stacks the vectors of the possibilities that have one into a matrix of unit rows
+
+    Args:
+        possibilities (list of Synset): candidate synsets
+        vector_dict (dict): synsetid -> vector, possibilities without a vector are left out
+
+    Returns:
+        (np.array of synsetids, np.array with one normalized vector per row)
+    """
+    ids = candidate_ids(possibilities, vector_dict.__contains__)
+    if not len(ids):
+        return ids, np.zeros((0, 0), dtype=np.float32)
+    matrix = np.array([vector_dict[sid] for sid in ids.tolist()], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1.0
+    return ids, matrix / norms[:, np.newaxis]
+
+def top_n(reference_vectors, reference_id_sets, candidate_ids, candidates, n=15, chunk_size=1024):
+    """ the n most cosine similar candidates of every reference vector, computed a chunk of references at a time
+
+    Args:
+        reference_vectors (np.array): one reference vector per row
+        reference_id_sets (list of set): synsetids to leave out for each row
+        candidate_ids (np.array): synsetid of each candidate
+        candidates (np.array): one unit vector per candidate, from candidate_matrix
+        n (int, optional): number of candidates to keep per row
+        chunk_size (int, optional): number of rows scored with each matrix multiply
+
+    Returns:
+        list with a list of (synsetid, sim) per row, best first and padded to n like find_similar_synsets
+    """
+    return list(iter_top_n(reference_vectors, reference_id_sets, candidate_ids, candidates, n, chunk_size))
+
+def iter_top_n(reference_vectors, reference_id_sets, candidate_ids, candidates, n=15, chunk_size=1024):
+    """ top_n as a generator, yields each row's list once its chunk is scored """
+    ids = candidate_ids.tolist()
+    column = dict((sid, j) for j, sid in enumerate(ids))
+    for start in xrange(0, len(reference_vectors), chunk_size):
+        chunk = np.asarray(reference_vectors[start:start + chunk_size], dtype=np.float32)
+        norms = np.linalg.norm(chunk, axis=1)
+        norms[norms == 0] = 1.0
+        sims = (chunk / norms[:, np.newaxis]).dot(candidates.T)
+        for r, ref_ids in enumerate(reference_id_sets[start:start + chunk_size]):
+            masked = [column[sid] for sid in ref_ids if sid in column]
+            sims[r, masked] = -np.inf
+
+        # keep everything tied with the n-th best, then break ties towards the larger synsetid like the heap does,
+        # the n-th best of each row is found by partitioning a copy of that row only, not of the whole chunk
+        k = min(n, sims.shape[1])
+        row = np.empty(sims.shape[1], dtype=sims.dtype)
+        for r in xrange(len(sims)):
+            np.negative(sims[r], out=row)
+            row.partition(k - 1)
+            best = np.flatnonzero(sims[r] >= -row[k - 1])
+            best = best[np.lexsort((-candidate_ids[best], -sims[r, best]))][:k]
+            found = [(ids[j], float(sims[r, j])) for j in best if sims[r, j] > -1.0]
+            yield found + [("000", -1.0)] * (n - len(found))
+
+_worker = dict() # candidates memory mapped by each pool worker
+
+def _init_worker(ids_fname, candidates_fname):
+    _worker["ids"] = np.load(ids_fname, mmap_mode="r")
+    _worker["candidates"] = np.load(candidates_fname, mmap_mode="r")
+
+def _top_n_block(args):
+    reference_vectors, reference_id_sets, n, chunk_size = args
+    return top_n(reference_vectors, reference_id_sets, _worker["ids"], _worker["candidates"], n, chunk_size)
+
+def top_n_parallel(reference_vectors, reference_id_sets, candidate_ids, candidates, n=15, chunk_size=1024, processes=None):
+    """ top_n with the chunks of references spread over a process pool
+
+    The candidates are written to a temporary .npy file that every worker memory maps, so they are
+    shared instead of pickled to each worker. Workers get the same chunks top_n would use, so the
+    results are identical to top_n and in the same order.
+
+    Args:
+        processes (int, optional): size of the pool, the number of cores if None
+        (other args as in top_n)
+
+    Returns:
+        same as top_n
+    """
+    return list(iter_top_n_parallel(reference_vectors, reference_id_sets, candidate_ids, candidates, n, chunk_size, processes))
+
+def iter_top_n_parallel(reference_vectors, reference_id_sets, candidate_ids, candidates, n=15, chunk_size=1024, processes=None):
+    """ top_n_parallel as a generator, yields rows in order as their chunks come back from the pool """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ids_fname = os.path.join(tmp_dir, "ids.npy")
+        candidates_fname = os.path.join(tmp_dir, "candidates.npy")
+        np.save(ids_fname, candidate_ids)
+        np.save(candidates_fname, candidates)
+        blocks = [(reference_vectors[start:start + chunk_size], reference_id_sets[start:start + chunk_size], n, chunk_size)
+                for start in xrange(0, len(reference_vectors), chunk_size)]
+        pool = multiprocessing.Pool(processes, _init_worker, (ids_fname, candidates_fname))
+        try:
+            for block in pool.imap(_top_n_block, blocks, chunksize=1):
+                for row in block:
+                    yield row
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def find_similar_synsets_batched(word_vectors, references, reference_id_sets, possibilities, vector_dict, n=15,
+        mode="exact", index=None, n_probe=8, processes=1, quantized=None):
+    """ find_similar_synsets for many keys at once with matrix multiplies instead of a python loop
+
+    Args:
+        word_vectors (gensim.KeyedVectors): word vectors used for references not in vector_dict
+        references (dict): key -> list of reference Synsets
+        reference_id_sets (dict): key -> set of synsetids to leave out for that key
+        possibilities (list of Synset): candidate synsets
+        vector_dict (dict): synsetid -> vector of the candidates
+        mode (str, optional): "exact" scores every candidate, "approx" searches an Ivf_Index of them,
+            "float16" and "int8" scan quantized candidates and rescore a shortlist with the exact ones
+        index (Ivf_Index, optional): prebuilt index of the possibilities with a vector for approx mode,
+            like the ones ann_index.main saves per pos, built on the fly if not given
+        n_probe (int, optional): lists searched per key in approx mode
+        processes (int, optional): spread exact mode over a pool of this many processes, None for
+            one per core
+        quantized (Quantized_Matrix, optional): the store quantized.main saves for the rows of word_vectors,
+            a Synset_Matrix, which the float16 and int8 modes scan instead of a candidate_matrix
+
+    Returns:
+        dict of key -> list of (synsetid, sim)
+    """
+    return dict(iter_similar_synsets_batched(word_vectors, references, reference_id_sets, possibilities, vector_dict, n,
+            mode, index, n_probe, processes, quantized=quantized))
+
+def iter_similar_synsets_batched(word_vectors, references, reference_id_sets, possibilities, vector_dict, n=15,
+        mode="exact", index=None, n_probe=8, processes=1, chunk_size=1024, quantized=None):
+    """ find_similar_synsets_batched as a generator, yields (key, list of (synsetid, sim)) in sorted key order
+        as each chunk of keys is scored """
+    if mode not in ["exact", "approx", "float16", "int8"]:
+        raise Exception("no such mode: %s, must be in {exact, approx, float16, int8}" % mode)
+    keys = sorted(references)
+    if not keys:
+        return
+    if mode == "approx" and index is not None:
+        # the index already holds the candidate vectors
+        ids = candidate_ids(possibilities, vector_dict.__contains__)
+        if not np.array_equal(np.sort(index.ids), np.sort(ids)):
+            raise Exception("the index holds %d synsets, not the %d possibilities with a vector" % (len(index), len(ids)))
+        candidates = None
+    elif mode in ["float16", "int8"]:
+        # the store already holds the candidate vectors, quantized, and the matrix the exact ones
+        if quantized is None or not isinstance(word_vectors, Synset_Matrix):
+            raise Exception("%s mode needs a Synset_Matrix and the quantized store of its rows" % mode)
+        if quantized.kind != mode or len(quantized) != len(word_vectors):
+            raise Exception("the store holds %d %s rows, not the %d %s rows of the matrix" % (len(quantized),
+                    quantized.kind, len(word_vectors), mode))
+        ids = candidate_ids(possibilities, word_vectors.covers)
+        rows = word_vectors.rows_of(ids)
+        candidates = None
+    else:
+        ids, candidates = candidate_matrix(possibilities, vector_dict)
+
+    def vector(synset):
+        v = vector_dict.get(synset.synsetid)
+        return synset.vectorize1(word_vectors) if v is None else v
+
+    reference_vectors = np.array([sum(vector(r) for r in references[key]) / float(len(references[key])) for key in keys])
+    if len(ids) == 0:
+        for key in keys:
+            yield key, [("000", -1.0)] * n
+        return
+    exclude = [reference_id_sets[key] for key in keys]
+    if mode == "approx":
+        if index is None:
+            index = Ivf_Index.build(ids, candidates)
+        found = (row for start in xrange(0, len(keys), chunk_size)
+                for row in index.search(reference_vectors[start:start + chunk_size], n, n_probe, exclude[start:start + chunk_size]))
+    elif mode in ["float16", "int8"]:
+        found = iter_top_n_rescored(reference_vectors, exclude, ids, word_vectors.vectors, quantized.select(rows), n,
+                chunk_size=chunk_size, candidate_rows=rows)
+    elif processes == 1:
+        found = iter_top_n(reference_vectors, exclude, ids, candidates, n, chunk_size)
+    else:
+        found = iter_top_n_parallel(reference_vectors, exclude, ids, candidates, n, chunk_size, processes)
+    for i, row in enumerate(found):
+        yield keys[i], row
     
 
-def learn_new_links(links, possible_synsets_to, possible_synsets_from):
+def learn_new_links(links, possible_synsets_to, possible_synsets_from, word_vectors=None, batched=True, mode="exact", processes=1,
+        index=None, quantized=None):
     """ Extends sets of words linked to synsets
 
     Args:
         links (list of Links): Links already of this type
         possible_synsets_to (list of Synset): possible synsets to link to
         possible_synsets_from (list of Synset): possible synsets to link from
+        word_vectors (gensim.KeyedVectors, Word_Vectors, Synset_Matrix, optional): vectors to use,
+            loaded from WV_FNAME if not given
+        batched (bool, optional): score all keys with find_similar_synsets_batched instead of one at a time
+        mode (str, optional): "exact", "approx" (Ivf_Index), "float16" or "int8" (quantized scan) search when batched
+        processes (int, optional): process pool size for batched exact search, None for one per core
+        index (tuple of Ivf_Index, optional): (index of possible_synsets_to, index of possible_synsets_from)
+            for approx mode, loaded with Ivf_Index.load instead of built on every run
+        quantized (Quantized_Matrix, optional): the store quantized.main saves for word_vectors, a
+            Synset_Matrix, needed by the float16 and int8 modes
 
     Return:
         A list of Links representing new propossed links
     """
-    # open pretrained model
-    print "loading model"
-    model = gensim.models.KeyedVectors.load_word2vec_format('./GoogleNews-vectors-negative300.bin', binary=True)
-    word_vectors = model.wv
-    del model
+    propossed_links_to = dict()
+    propossed_links_from = dict()
+    synset_lookup = dict()
+    for direction, synsetid, proposals in iter_new_links(links, possible_synsets_to, possible_synsets_from, word_vectors,
+            batched, mode, processes, synset_lookup, index, quantized):
+        if direction == "to":
+            propossed_links_to[synsetid] = proposals
+        else:
+            propossed_links_from[synsetid] = proposals
+
+    return (propossed_links_to, propossed_links_from, synset_lookup)
+
+def iter_new_links(links, possible_synsets_to, possible_synsets_from, word_vectors=None, batched=True, mode="exact", processes=1,
+        synset_lookup=None, index=None, quantized=None):
+    """ learn_new_links as a generator, so proposals can be written out as soon as each top n is found
+
+    Args:
+        links (iterable of Links): Links already of this type, can be a generator like get_links.iter_links
+        synset_lookup (dict, optional): filled with synsetid -> Synset of the linked synsets
+        (other args as in learn_new_links)
+
+    Yields:
+        ("to", s1id, list of (s2id, sim)) for every synset with links, then ("from", s2id, list of (s1id, sim))
+    """
+    if word_vectors is None:
+        # open pretrained model
+        print "loading model"
+        word_vectors = load_word_vectors(WV_FNAME)
+    if synset_lookup is None:
+        synset_lookup = dict()
     
-    print "vectorizing synsets"
     id_to_vector = dict()
-    for synset in (possible_synsets_to + possible_synsets_from):
-        if synset.synsetid not in id_to_vector and synset.is_in(word_vectors):
-            id_to_vector[synset.synsetid] = synset.vectorize1(word_vectors)
+    if not (batched and mode in ["float16", "int8"]):
+        # the quantized modes read the candidates from the store and the matrix
+        print "vectorizing synsets"
+        for synset in (possible_synsets_to + possible_synsets_from):
+            if synset.synsetid not in id_to_vector and synset.is_in(word_vectors):
+                id_to_vector[synset.synsetid] = synset.vectorize1(word_vectors)
 
     # sort links into dictionaries
     print "sorting links into "
@@ -65,7 +306,6 @@ def learn_new_links(links, possible_synsets_to, possible_synsets_from):
     links_to_synsetids = dict() # links_to[s] should have a list of synset ids s links to
     links_from = dict() # links_from[s] should have a list of words linked to s
     links_from_synsetids = dict() # links_from[s] should have a list of synsets linked to s
-    synset_lookup = dict()
     for link in links:
         s1, s2 = link.synset1, link.synset2
         if not s1.is_in(word_vectors) or not s2.is_in(word_vectors):
@@ -88,35 +328,65 @@ def learn_new_links(links, possible_synsets_to, possible_synsets_from):
             links_from_synsetids[s2.synsetid].add(s1.synsetid)
 
     # now find new links
-    propossed_links_to = dict()
+    if batched:
+        print "looking for new links"
+        index_to, index_from = index if index is not None else (None, None)
+        for s1id, s2s in iter_similar_synsets_batched(word_vectors, links_to, links_to_synsetids, possible_synsets_to, id_to_vector,
+                mode=mode, index=index_to, processes=processes, quantized=quantized):
+            yield "to", s1id, s2s
+        for s2id, s1s in iter_similar_synsets_batched(word_vectors, links_from, links_from_synsetids, possible_synsets_from, id_to_vector,
+                mode=mode, index=index_from, processes=processes, quantized=quantized):
+            yield "from", s2id, s1s
+        return
+
     print "looking for new links to"
     for s1id, s2s in links_to.iteritems():
         ref_set = links_to_synsetids[s1id]
-        propossed_links_to[s1id] = find_similar_synsets(word_vectors, s2s, ref_set, possible_synsets_to, id_to_vector)
+        yield "to", s1id, find_similar_synsets(word_vectors, s2s, ref_set, possible_synsets_to, id_to_vector)
 
     print "looking for new links from"
-    propossed_links_from = dict()
     for s2id, s1s in links_from.iteritems():
         ref_set = links_from_synsetids[s2id]
-        propossed_links_from[s2id] = find_similar_synsets(word_vectors, s1s, ref_set, possible_synsets_from, id_to_vector)
-
-    return (propossed_links_to, propossed_links_from, synset_lookup)
+        yield "from", s2id, find_similar_synsets(word_vectors, s1s, ref_set, possible_synsets_from, id_to_vector)
 
 WN_FNAME = "wordnet_3.1+.db"
+WV_FNAME = "./GoogleNews-vectors-negative300.bin" # or the prefix of a Word_Vectors store or Synset_Matrix
 def main(args):
-    links = get_links(args[0], WN_FNAME)
-    possible_synsets_to = get_synsets_by_pos(args[2], WN_FNAME)
-    possible_synsets_from = get_synsets_by_pos(args[1], WN_FNAME)
-    proposed_links_to, proposed_links_from, _ = learn_new_links(links, possible_synsets_to, possible_synsets_from)
+    """ set_extension.py <link> <pos_from> <pos_to> <out> [vectors] [mode] [processes] [index or store prefix]
 
-    output = open(args[3], "wb")
-    for s1id, s2s in proposed_links_to.iteritems():
-        for s2id, sim in s2s:
-            output.write("%s,%s,%f\n" %(s1id, s2id, sim))
+    in approx mode the indexes of both pos are loaded from the prefix ann_index.main saved them with,
+    the float16 and int8 modes need a Synset_Matrix as vectors and load the store quantized.main saved
+    for it, from the matrix prefix by default, set WN_PROFILE to a json file name to profile the run
+    """
+    profiling.enable_from_env()
+    links = iter_links(args[0], WN_FNAME)
+    possible_synsets_to = get_synsets_by_pos(args[2], WN_FNAME, lazy=True)
+    possible_synsets_from = get_synsets_by_pos(args[1], WN_FNAME, lazy=True)
+    word_vectors = load_word_vectors(args[4]) if len(args) > 4 else None
+    mode = args[5] if len(args) > 5 else "exact"
+    processes = int(args[6]) if len(args) > 6 else 1
+    index = None
+    if mode == "approx" and len(args) > 7:
+        index_to = Ivf_Index.load(index_fname(args[7], args[2]))
+        index_from = index_to if args[1] == args[2] else Ivf_Index.load(index_fname(args[7], args[1]))
+        index = (index_to, index_from)
+    quantized = None
+    if mode in ["float16", "int8"]:
+        quantized = Quantized_Matrix.load(args[7] if len(args) > 7 else args[4], mode)
+    proposals = iter_new_links(links, possible_synsets_to, possible_synsets_from, word_vectors,
+            mode=mode, processes=processes or None, index=index, quantized=quantized)
 
-    for s2id, s1s in proposed_links_from.iteritems():
-        for s1id, sim in s1s:
-            output.write("%s,%s,%f\n" %(s1id, s2id, sim))
+    # write each synset's proposals as soon as they are found
+    output = open(args[3], "wb")
+    for direction, synsetid, found in proposals:
+        for other_id, sim in found:
+            if direction == "to":
+                output.write("%s,%s,%f\n" %(synsetid, other_id, sim))
+            else:
+                output.write("%s,%s,%f\n" %(other_id, synsetid, sim))
+        output.flush()
+    output.close()
+    profiling.finish()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file
@@ -1,19 +1,29 @@
 from synset import Synset, get_synsets_by_pos
 from get_links import Link, get_links
-import sys, gensim, random, math
+from word_store import load_word_vectors
+from synset_matrix import Synset_Matrix
+from quantized import Quantized_Matrix
+import sys, csv
 import numpy as np
 import matplotlib.pyplot as plt
-import sys, heapq, csv
+import profiling
 
 
-def similarity(s1, s2, wv, avg_n=np.zeros(300), avg_v=np.zeros(300), mul=True):
+def similarity(s1, s2, wv, avg_n=np.zeros(300), avg_v=np.zeros(300), mul=True, quantized=None):
     """ returns the cosine similarity of 2 synsets
 
+    Args:
+        quantized (Quantized_Matrix, optional): the store quantized.main saved for wv, a Synset_Matrix,
+            to read the two vectors from instead, the similarity is then approximate
+
     Returns:
         float of the cossine similarity
     """
-    v1 = s1.vectorize1(wv) 
-    v2 = s2.vectorize1(wv)
+    if quantized is None:
+        v1 = s1.vectorize1(wv) 
+        v2 = s2.vectorize1(wv)
+    else:
+        v1, v2 = store_vectors([s1, s2], wv, quantized)[0].rows(0, 2)
     if np.sum(v1) == 0 or np.sum(v2) == 0:
         return 0.0
     v2 = v2 / np.linalg.norm(v2)
@@ -24,20 +34,215 @@ def similarity(s1, s2, wv, avg_n=np.zeros(300), avg_v=np.zeros(300), mul=True):
         sim = np.dot(v1, v2) + np.dot(v2, avg_v) + np.dot(v1, avg_n)
     return sim
 
+def unit_vectors(synsets, wv):
+    """ vectorizes synsets once into a matrix of unit rows
+
+    Returns:
+        (np.array with one unit vector per synset, np.array of bool marking the synsets similarity
+        scores, the others have a zero vector and always get 0.0)
+    """
+    vectors = np.array([s.vectorize1(wv) for s in synsets], dtype=np.float32)
+    valid = vectors.sum(axis=1) != 0
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[~valid] = 1.0
+    vectors /= norms[:, np.newaxis]
+    vectors[~valid] = 0.0
+    return vectors, valid
+
+def store_vectors(synsets, matrix, store):
+    """ the quantized unit vectors of synsets, picked out of the store quantized.main saved for matrix
+
+    Returns:
+        (Quantized_Matrix with one row per synset, zero for the synsets the matrix does not cover,
+        np.array of the matrix row of each synset, -1 for the ones it does not store)
+    """
+    rows = matrix.rows_of([s.synsetid for s in synsets])
+    covered = rows >= 0
+    covered[covered] = matrix.covered[rows[covered]]
+    selected = store.select(np.maximum(rows, 0))
+    selected.codes[~covered] = 0
+    return selected, rows
+
+def matrix_unit_vectors(matrix, rows):
+    """ unit_vectors of the synsets at some rows of a Synset_Matrix, reading only those rows """
+    vectors = np.array(matrix.vectors[np.maximum(rows, 0)], dtype=np.float32)
+    vectors[rows < 0] = 0.0
+    valid = vectors.sum(axis=1) != 0
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[~valid] = 1.0
+    vectors /= norms[:, np.newaxis]
+    vectors[~valid] = 0.0
+    return vectors, valid
+
+def _projections(vectors, avg):
+    """ (vectors.dot(avg), mask of the nonzero rows) of unit vectors or of a Quantized_Matrix """
+    if isinstance(vectors, Quantized_Matrix):
+        return vectors.dot(avg[np.newaxis])[0], vectors.codes.any(axis=1)
+    return vectors.dot(avg), vectors.any(axis=1)
+
+def _take(vectors, rows):
+    """ rows of unit vectors or of a Quantized_Matrix as float32 """
+    if isinstance(vectors, Quantized_Matrix):
+        return vectors.take(rows)
+    return vectors[rows]
+
+def score_pairs(nouns, verbs, noun_rows, verb_rows, avg_n, avg_v, mul=True, chunk_size=1 << 18):
+    """ similarity for many (noun, verb) pairs at once
+
+    Args:
+        nouns (np.array, Quantized_Matrix): unit noun vectors from unit_vectors, or from store_vectors
+            for approximate scores
+        verbs (np.array, Quantized_Matrix): unit verb vectors, like nouns
+        noun_rows (np.array of int): noun row of each pair
+        verb_rows (np.array of int): verb row of each pair
+        avg_n (np.array): unit average noun vector
+        avg_v (np.array): unit average verb vector
+        mul (bool, optional): multiply the three similarities instead of adding them
+
+    Returns:
+        np.array with the score of each pair
+    """
+    to_n, valid_n = _projections(nouns, avg_n)
+    to_v, valid_v = _projections(verbs, avg_v)
+    scores = np.empty(len(noun_rows), dtype=np.float64)
+    for start in xrange(0, len(noun_rows), chunk_size):
+        ni = noun_rows[start:start + chunk_size]
+        vi = verb_rows[start:start + chunk_size]
+        cross = np.einsum("ij,ij->i", _take(nouns, ni), _take(verbs, vi))
+        if mul:
+            scores[start:start + chunk_size] = cross * to_v[vi] * to_n[ni]
+        else:
+            scores[start:start + chunk_size] = cross + to_v[vi] + to_n[ni]
+    scores[~(valid_n[noun_rows] & valid_v[verb_rows])] = 0.0
+    return scores
+
+def _largest(scores, noun_rows, verb_rows, k):
+    """ the k best pairs, best first, ties going to the larger noun row and then verb row """
+    if k <= 0:
+        return scores[:0], noun_rows[:0], verb_rows[:0]
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, noun_rows, verb_rows = scores[keep], noun_rows[keep], verb_rows[keep]
+    order = np.lexsort((-verb_rows, -noun_rows, -scores))
+    return scores[order], noun_rows[order], verb_rows[order]
+
+def top_pairs(nouns, verbs, avg_n, avg_v, k, mul=True, block_size=256):
+    """ the k best scoring pairs of the full noun x verb cross product
+
+    The cross product is scored a block of nouns at a time and only a running top k is kept, so
+    memory stays at O(k + block_size * number of verbs). The running top k is only partitioned per
+    block and sorted once at the end. nouns and verbs are as in score_pairs, with Quantized_Matrix
+    ones the cross product is scanned quantized and the scores are approximate.
+
+    Returns:
+        (scores, noun rows, verb rows) of the best k pairs, best first
+    """
+    to_n, valid_n = _projections(nouns, avg_n)
+    to_v, valid_v = _projections(verbs, avg_v)
+    best = (np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    if k <= 0:
+        return best
+    for start in xrange(0, len(nouns), block_size):
+        if isinstance(nouns, Quantized_Matrix):
+            noun_block = nouns.rows(start, start + block_size)
+        else:
+            noun_block = nouns[start:start + block_size]
+        if isinstance(verbs, Quantized_Matrix):
+            block = verbs.dot(noun_block).astype(np.float64)
+        else:
+            block = noun_block.dot(verbs.T).astype(np.float64)
+        if mul:
+            block *= to_v[np.newaxis, :] * to_n[start:start + block_size, np.newaxis]
+        else:
+            block += to_v[np.newaxis, :] + to_n[start:start + block_size, np.newaxis]
+        block[~valid_n[start:start + block_size], :] = 0.0
+        block[:, ~valid_v] = 0.0
+        flat = block.ravel()
+        if len(flat) > k:
+            keep = np.argpartition(-flat, k - 1)[:k]
+        else:
+            keep = np.arange(len(flat))
+        noun_rows = keep // len(verbs) + start
+        verb_rows = keep % len(verbs)
+        scores = np.concatenate([best[0], flat[keep]])
+        noun_rows = np.concatenate([best[1], noun_rows])
+        verb_rows = np.concatenate([best[2], verb_rows])
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k - 1)[:k]
+            scores, noun_rows, verb_rows = scores[keep], noun_rows[keep], verb_rows[keep]
+        best = (scores, noun_rows, verb_rows)
+    return _largest(best[0], best[1], best[2], k)
+
+def rescore(matrix, noun_matrix_rows, verb_matrix_rows, noun_rows, verb_rows, avg_n, avg_v, mul=True):
+    """ exact score_pairs of pairs scored on the quantized store, reading only their rows of the matrix
+
+    Args:
+        matrix (Synset_Matrix): the synset vectors the store was saved for
+        noun_matrix_rows (np.array): matrix row of each noun, from store_vectors
+        verb_matrix_rows (np.array): matrix row of each verb, from store_vectors
+        (other args as in score_pairs)
+
+    Returns:
+        np.array with the score of each pair
+    """
+    nouns_used, noun_at = np.unique(noun_rows, return_inverse=True)
+    verbs_used, verb_at = np.unique(verb_rows, return_inverse=True)
+    nouns, _ = matrix_unit_vectors(matrix, noun_matrix_rows[nouns_used])
+    verbs, _ = matrix_unit_vectors(matrix, verb_matrix_rows[verbs_used])
+    return score_pairs(nouns, verbs, noun_at, verb_at, avg_n, avg_v, mul)
+
+def top_pairs_rescored(matrix, nouns, verbs, noun_matrix_rows, verb_matrix_rows, avg_n, avg_v, k, mul=True,
+        oversample=2, block_size=256, noun_rows=None, verb_rows=None):
+    """ top_pairs of the quantized nouns and verbs from store_vectors, with the shortlist rescored exactly
+
+    The k * oversample best pairs of the quantized scan are rescored from the matrix, so the
+    scores are the same as top_pairs and only pairs that fell out of the shortlist are missed.
+    Given noun_rows and verb_rows, only those pairs are scanned instead of the cross product.
+
+    Args:
+        matrix (Synset_Matrix): the synset vectors the store was saved for
+        nouns (Quantized_Matrix): quantized noun vectors from store_vectors
+        verbs (Quantized_Matrix): quantized verb vectors from store_vectors
+        noun_matrix_rows (np.array): matrix row of each noun, from store_vectors
+        verb_matrix_rows (np.array): matrix row of each verb, from store_vectors
+        oversample (int, optional): shortlist size as a multiple of k
+        noun_rows (np.array of int, optional): noun row of each pair to score, like a sample
+        verb_rows (np.array of int, optional): verb row of each pair to score
+
+    Returns:
+        (scores, noun rows, verb rows) of the best k pairs, best first
+    """
+    if noun_rows is None:
+        _, noun_rows, verb_rows = top_pairs(nouns, verbs, avg_n, avg_v, k * oversample, mul, block_size)
+    else:
+        scores = score_pairs(nouns, verbs, noun_rows, verb_rows, avg_n, avg_v, mul)
+        _, noun_rows, verb_rows = _largest(scores, noun_rows, verb_rows, k * oversample)
+    scores = rescore(matrix, noun_matrix_rows, verb_matrix_rows, noun_rows, verb_rows, avg_n, avg_v, mul)
+    return _largest(scores, noun_rows, verb_rows, k)
+
 def main(args):
-    sample = int(args[0])
+    """ similarity_extension.py <sample size or all> <cuttoff> <out.csv> [vectors] [float32, float16 or int8]
+
+    sampled pairs are drawn with np.random, seed it to reproduce a sample,
+    float16 and int8 need a Synset_Matrix as vectors and score on the store quantized.main saved for it,
+    set WN_PROFILE to a json file name to profile the run
+    """
+    profiling.enable_from_env()
+    exhaustive = args[0] == "all"
+    sample = 0 if exhaustive else int(args[0])
     cuttoff = float(args[1])
     if cuttoff > 1.0 or cuttoff < 0.0:
         raise Exception("cuttoff must be between 0.0 and 1.0")
     
-    model = gensim.models.KeyedVectors.load_word2vec_format('./GoogleNews-vectors-negative300.bin', binary=True)
-    word_vectors = model.wv
-    del model
+    word_vectors = load_word_vectors(args[3] if len(args) > 3 else './GoogleNews-vectors-negative300.bin')
+    kind = args[4] if len(args) > 4 else "float32" # or float16 / int8 to score on the quantized store
+    if kind != "float32" and not isinstance(word_vectors, Synset_Matrix):
+        raise Exception("%s needs a Synset_Matrix and the quantized store of its rows" % kind)
 
     WN_FILE_NAME = "wordnet_3.1+.db"
 
-    random_nouns = get_synsets_by_pos("n", WN_FILE_NAME)
-    random_verbs = get_synsets_by_pos("v", WN_FILE_NAME)
+    random_nouns = get_synsets_by_pos("n", WN_FILE_NAME, lazy=True)
+    random_verbs = get_synsets_by_pos("v", WN_FILE_NAME, lazy=True)
 
     linked = get_links("action", WN_FILE_NAME)
     linked_n_vecs = [l.synset1.vectorize1(word_vectors) for l in linked if l.synset1.is_in(word_vectors)]
@@ -48,15 +253,35 @@ def main(args):
     avg_n = sum(linked_n_vecs)
     avg_n = avg_n/np.linalg.norm(avg_n)
 
-    random_sample = [(random.choice(random_nouns), random.choice(random_verbs)) for _ in range (sample)]
-    random_sample = [(similarity(n, v, word_vectors, avg_n, avg_v), n.synsetid, v. synsetid) for n, v in random_sample]
-
-    search_sample = heapq.nlargest(int(sample * cuttoff), random_sample)
+    if kind == "float32":
+        nouns, _ = unit_vectors(random_nouns, word_vectors)
+        verbs, _ = unit_vectors(random_verbs, word_vectors)
+    else:
+        store = Quantized_Matrix.load(args[3], kind)
+        nouns, noun_matrix_rows = store_vectors(random_nouns, word_vectors, store)
+        verbs, verb_matrix_rows = store_vectors(random_verbs, word_vectors, store)
+    if exhaustive:
+        k = int(len(random_nouns) * len(random_verbs) * cuttoff)
+        if kind == "float32":
+            scores, noun_rows, verb_rows = top_pairs(nouns, verbs, avg_n, avg_v, k)
+        else:
+            scores, noun_rows, verb_rows = top_pairs_rescored(word_vectors, nouns, verbs, noun_matrix_rows,
+                    verb_matrix_rows, avg_n, avg_v, k)
+    else:
+        noun_rows = np.random.randint(0, len(random_nouns), sample)
+        verb_rows = np.random.randint(0, len(random_verbs), sample)
+        if kind == "float32":
+            scores = score_pairs(nouns, verbs, noun_rows, verb_rows, avg_n, avg_v)
+            scores, noun_rows, verb_rows = _largest(scores, noun_rows, verb_rows, int(sample * cuttoff))
+        else:
+            scores, noun_rows, verb_rows = top_pairs_rescored(word_vectors, nouns, verbs, noun_matrix_rows,
+                    verb_matrix_rows, avg_n, avg_v, int(sample * cuttoff), noun_rows=noun_rows, verb_rows=verb_rows)
 
     with open(args[2], 'wb') as f:
         writer = csv.writer(f)
-        for sim, nid, vid in search_sample:
-            writer.writerow([nid, vid, sim])
+        for sim, ni, vi in zip(scores.tolist(), noun_rows.tolist(), verb_rows.tolist()):
+            writer.writerow([random_nouns[ni].synsetid, random_verbs[vi].synsetid, sim])
+    profiling.finish()
         
 
 if __name__ == "__main__":
@@ -1,7 +1,16 @@
-import sqlite3
 import numpy as np
+from synset_matrix import Synset_Matrix
+from wn_sql import connect
 POS_MAP = {1: "n", 2: "v", 3:"a", 5:"s"}
-class Synset:
+
+_WORDS = dict() # one shared string object per word across all synsets
+
+def _intern(word):
+    return _WORDS.setdefault(word, word)
+
+_PENDING = object() # gloss of a lazy synset that has not been fetched yet
+
+class Synset(object):
     """ A class that represents holds relevant information for a synset 
     
     Args:
@@ -9,32 +18,101 @@ class Synset:
         wn_db (sqlite cursor): a sqlite cursor that can access WordNet information
         get_gloss (bool, optional): boolean for if we should get the gloss from the database
         provided_gloss (str, optional): gloss of the synset
+        sense_rows (list of tuple, optional): preloaded (old_sensekey, wordid) rows, skips the senses query
+        num_senses (list of float, optional): preloaded number of senses of each word in sense_rows
+        lazy (bool, optional): do not query anything until words, sense keys, word ids, pos or gloss are used
+        pos (str, optional): part of speech, if known a lazy synset does not load its senses for it
+        loader (Synset_Registry, optional): registry that loads pending lazy synsets together
     Attributes:
         words (list of str): the words accociated with the synset
         sense_keys (list of str): the sensekeys (old) accociated with the synset
         synsetid (int): the synsetid in wn_db
         pos (str): the part of speech
     """
+    __slots__ = ("synsetid", "wn_db", "_pos", "_words", "_sense_keys", "_wordids", "_gloss", "_num_senses", "_loader")
 
-    def __init__(self, synsetid, wn_db, get_glosss=False, provided_gloss=None):
-        wn_db.execute("SELECT old_sensekey, wordid FROM senses WHERE synsetid=?", (synsetid,))
-        fetched_data = wn_db.fetchall()
-        self.sense_keys = [t[0] for t in fetched_data]
-        self.wordids = [t[1] for t in fetched_data]
-        self.words = [s.split("%")[0] for s in self.sense_keys]
+    def __init__(self, synsetid, wn_db, get_glosss=False, provided_gloss=None, sense_rows=None, num_senses=None,
+            lazy=False, pos=None, loader=None):
         self.synsetid = synsetid
-        try:
-            self.pos = POS_MAP.get(int(self.sense_keys[0].split("%")[1][0]), "?") # pos number if right after % in old sensekeys
-        except:
-            self.pos = "?"
-        self.gloss = provided_gloss
         self.wn_db = wn_db
-        self._num_senses = None
-        if get_glosss:
+        self._num_senses = num_senses
+        self._loader = loader
+        self._pos = pos
+        self._words = self._sense_keys = self._wordids = None
+        if lazy:
+            self._gloss = _PENDING if provided_gloss is None else provided_gloss
+            if loader is not None:
+                loader.defer(self)
+            return
+
+        if sense_rows is None:
+            wn_db.execute("SELECT old_sensekey, wordid FROM senses WHERE synsetid=?", (synsetid,))
+            fetched_data = wn_db.fetchall()
+        else:
+            fetched_data = sense_rows
+        self._set_senses(fetched_data)
+        self._gloss = provided_gloss
+        if get_glosss and provided_gloss is None:
             wn_db.execute("SELECT definition FROM synsets WHERE synsetid=?", (synsetid,))
-            self.gloss = wn_db.fetchone()[0]
+            self._gloss = wn_db.fetchone()[0]
+
+    def _set_senses(self, rows):
+        self._sense_keys = [t[0] for t in rows]
+        self._wordids = [t[1] for t in rows]
+        self._words = [_intern(s.split("%")[0]) for s in self._sense_keys]
+        try:
+            self._pos = POS_MAP.get(int(self._sense_keys[0].split("%")[1][0]), "?") # pos number if right after % in old sensekeys
+        except:
+            if self._pos is None:
+                self._pos = "?"
+
+    def _load(self):
+        """ fetches the fields of a lazy synset, along with every other pending synset of its loader """
+        if self._loader is not None:
+            self._loader.resolve()
+        if self._sense_keys is None or self._gloss is _PENDING:
+            resolve_synsets([self], self.wn_db)
+
+    @property
+    def words(self):
+        if self._words is None:
+            self._load()
+        return self._words
+
+    @property
+    def sense_keys(self):
+        if self._sense_keys is None:
+            self._load()
+        return self._sense_keys
+
+    @property
+    def wordids(self):
+        if self._wordids is None:
+            self._load()
+        return self._wordids
+
+    @property
+    def pos(self):
+        if self._pos is None:
+            self._load()
+        return self._pos
+
+    @property
+    def gloss(self):
+        if self._gloss is _PENDING:
+            self._load()
+        return self._gloss
+
+    @property
+    def is_loaded(self):
+        return self._sense_keys is not None and self._gloss is not _PENDING
 
     def _get_number_of_senses(self):
+        if self._sense_keys is None:
+            # lazy synsets get their sense counts along with their senses
+            self._load()
+            if self._num_senses is not None:
+                return
 
         def f(wordid):
             self.wn_db.execute("SELECT count(1) FROM senses WHERE wordid=?", (wordid,))
@@ -49,11 +127,13 @@ class Synset:
         """ Returns whether a word in the synset is included in obj. 
         
         Args:
-            obj (set, dict, list): object to see if words in
+            obj (set, dict, list, Synset_Matrix): object to see if words in
 
         Returns:
             True if one of the words is in obj False otherwise
         """
+        if isinstance(obj, Synset_Matrix):
+            return obj.covers(self.synsetid)
         for w in self.words:
             if w in obj:
                 return True
@@ -77,11 +157,14 @@ class Synset:
         where v_w is w's vector and s_w is the number of senses w has
 
         Args:
-            word_vectors (gensim.KeyedVectors): gensim KeyedVecor model holding the word vectors
+            word_vectors (gensim.KeyedVectors, Synset_Matrix): gensim KeyedVecor model holding the word vectors,
+                or a Synset_Matrix built from one, which makes this a row lookup
 
         Returns:
             numpy array of the resulting vector
         """
+        if isinstance(word_vectors, Synset_Matrix):
+            return word_vectors.vector(self.synsetid)
         if not self._num_senses:
             self._get_number_of_senses()
         
@@ -92,11 +175,198 @@ class Synset:
         sm = sum(word_vectors[w] / float(ns) for w, ns in zip(self.words, self._num_senses) if w in word_vectors) 
         return sm / np.linalg.norm(sm)
         
-def get_synsets_by_pos(pos, wn_fname):
+MAX_SQL_VARS = 900 # stay under sqlite's default limit of 999 bound parameters
+
+def _chunks(lst, size=MAX_SQL_VARS):
+    for i in range(0, len(lst), size):
+        yield lst[i:i + size]
+
+def _fetch_glosses(wn_db, synsetids):
+    glosses = dict()
+    for chunk in _chunks(synsetids):
+        wn_db.execute("SELECT synsetid, definition FROM synsets WHERE synsetid IN ({0})".format(
+                ", ".join("?" for _ in chunk)), chunk)
+        glosses.update(wn_db.fetchall())
+    return glosses
+
+def _fetch_sense_rows(wn_db, synsetids):
+    sense_rows = dict()
+    for chunk in _chunks(synsetids):
+        wn_db.execute("SELECT synsetid, old_sensekey, wordid FROM senses WHERE synsetid IN ({0})".format(
+                ", ".join("?" for _ in chunk)), chunk)
+        for snid, sensekey, wordid in wn_db.fetchall():
+            sense_rows.setdefault(snid, []).append((sensekey, wordid))
+    return sense_rows
+
+def _fetch_sense_counts(wn_db, sense_rows):
+    """ number of senses of every word used by sense_rows """
+    wordids = list(set(wid for rows in sense_rows.itervalues() for _, wid in rows))
+    sense_counts = dict()
+    for chunk in _chunks(wordids):
+        wn_db.execute("SELECT wordid, count(1) FROM senses WHERE wordid IN ({0}) GROUP BY wordid".format(
+                ", ".join("?" for _ in chunk)), chunk)
+        sense_counts.update(wn_db.fetchall())
+    return sense_counts
+
+def resolve_synsets(synsets, wn_db):
+    """ Fetches the pending fields of many lazy synsets at once
+
+    Args:
+        synsets (list of Synset): synsets, the ones already loaded are skipped
+        wn_db (sqlite cursor): a sqlite cursor that can access WordNet information
+    """
+    need_senses = list(set(s.synsetid for s in synsets if s._sense_keys is None))
+    need_gloss = list(set(s.synsetid for s in synsets if s._gloss is _PENDING))
+    sense_rows = _fetch_sense_rows(wn_db, need_senses)
+    sense_counts = _fetch_sense_counts(wn_db, sense_rows)
+    glosses = _fetch_glosses(wn_db, need_gloss)
+    for synset in synsets:
+        if synset._sense_keys is None:
+            rows = sense_rows.get(synset.synsetid, [])
+            synset._set_senses(rows)
+            if synset._num_senses is None:
+                synset._num_senses = [float(sense_counts[wid]) for _, wid in rows]
+        if synset._gloss is _PENDING:
+            synset._gloss = glosses.get(synset.synsetid)
+
+def load_synsets(wn_db, pos=None, synsetids=None, with_glosses=True):
+    """ Builds Synsets in bulk with a few set based queries instead of one query per synset
+
+    Either pos or synsetids must be given. The synsets, their sense keys and word ids, and the
+    number of senses of every word are each fetched with one query (one per chunk of ids)
+
+    Args:
+        wn_db (sqlite cursor): a sqlite cursor that can access WordNet information
+        pos (str, optional): load every synset of this part of speech
+        synsetids (list of int, optional): load these synsets, in this order
+        with_glosses (bool, optional): fetch the glosses of synsetids too, otherwise each gloss is
+            only fetched if it is used (the glosses of a pos come with its synsetids for free)
+
+    Returns:
+        list of Synset objects
+    """
+    if (pos is None) == (synsetids is None):
+        raise Exception("load_synsets needs exactly one of pos or synsetids")
+
+    glosses = dict()
+    sense_rows = dict()
+    if pos is not None:
+        wn_db.execute("SELECT synsetid, definition FROM synsets WHERE pos=?", (pos,))
+        order = []
+        for snid, gloss in wn_db.fetchall():
+            order.append(snid)
+            glosses[snid] = gloss
+        wn_db.execute("SELECT senses.synsetid, senses.old_sensekey, senses.wordid FROM senses "
+                "INNER JOIN synsets ON senses.synsetid=synsets.synsetid WHERE synsets.pos=?", (pos,))
+        for snid, sensekey, wordid in wn_db.fetchall():
+            sense_rows.setdefault(snid, []).append((sensekey, wordid))
+    else:
+        order = list(synsetids)
+        unique_ids = list(set(order))
+        if with_glosses:
+            glosses.update(_fetch_glosses(wn_db, unique_ids))
+        sense_rows.update(_fetch_sense_rows(wn_db, unique_ids))
+
+    sense_counts = _fetch_sense_counts(wn_db, sense_rows)
+    synsets = []
+    for snid in order:
+        rows = sense_rows.get(snid, [])
+        gloss = glosses.get(snid) if pos is not None or with_glosses else _PENDING
+        synsets.append(Synset(snid, wn_db, provided_gloss=gloss, sense_rows=rows,
+                num_senses=[float(sense_counts[wid]) for _, wid in rows]))
+    return synsets
+
+class Synset_Registry:
+    """ Identity map from synsetid to a single shared Synset
+
+    Links, synset lists and searches that go through the same registry get the same Synset object
+    for a synsetid, so each synset is loaded once and its sense counts are cached once. Lazy synsets
+    created by the registry are pending until one of them is used, which loads all pending synsets
+    with one query per table
+
+    Args:
+        wn_db (sqlite cursor): a sqlite cursor that can access WordNet information
+
+    Attributes:
+        synsets (dict): synsetid -> Synset of every synset loaded so far
+    """
+
+    def __init__(self, wn_db):
+        self.wn_db = wn_db
+        self.synsets = dict()
+        self._pos_order = dict() # pos -> synsetids of that pos in database order
+        self._pending = [] # lazy synsets that have not been loaded
+
+    def defer(self, synset):
+        self._pending.append(synset)
+
+    def resolve(self):
+        """ loads every pending lazy synset """
+        pending, self._pending = self._pending, []
+        resolve_synsets(pending, self.wn_db)
+
+    def get(self, synsetid, lazy=False, with_glosses=True):
+        synset = self.synsets.get(synsetid)
+        if synset is None or (with_glosses and not lazy and synset._gloss is _PENDING and synset._sense_keys is not None):
+            synset = self.get_many([synsetid], lazy, with_glosses)[0]
+        return synset
+
+    def get_many(self, synsetids, lazy=False, with_glosses=True):
+        """ the shared Synsets of synsetids, loading the missing ones in bulk (or deferring them if lazy)
+
+        Without with_glosses the glosses of the synsets loaded are left to be fetched when used. With
+        it the glosses still missing from synsets loaded before are fetched in bulk too.
+        """
+        missing = [sid for sid in set(synsetids) if sid not in self.synsets]
+        if missing and lazy:
+            for sid in missing:
+                self.synsets[sid] = Synset(sid, self.wn_db, lazy=True, loader=self)
+        elif missing:
+            for synset in load_synsets(self.wn_db, synsetids=missing, with_glosses=with_glosses):
+                self.synsets[synset.synsetid] = synset
+        synsets = [self.synsets[sid] for sid in synsetids]
+        if with_glosses and not lazy:
+            pending = [s for s in synsets if s._gloss is _PENDING and s._sense_keys is not None]
+            if pending:
+                resolve_synsets(pending, self.wn_db)
+        return synsets
+
+    def by_pos(self, pos, lazy=False):
+        """ the shared Synsets of every synset of a part of speech, lazy ones only cost the synsetid query """
+        if pos not in self._pos_order:
+            order = []
+            if lazy:
+                self.wn_db.execute("SELECT synsetid FROM synsets WHERE pos=?", (pos,))
+                for sid, in self.wn_db.fetchall():
+                    if sid not in self.synsets:
+                        self.synsets[sid] = Synset(sid, self.wn_db, lazy=True, pos=pos, loader=self)
+                    order.append(sid)
+            else:
+                for synset in load_synsets(self.wn_db, pos=pos):
+                    self.synsets.setdefault(synset.synsetid, synset)
+                    order.append(synset.synsetid)
+            self._pos_order[pos] = order
+        return [self.synsets[sid] for sid in self._pos_order[pos]]
+
+    def __len__(self):
+        return len(self.synsets)
+
+_REGISTRIES = dict()
+
+def get_registry(wn_fname):
+    """ the Synset_Registry shared by everything reading wn_fname """
+    if wn_fname not in _REGISTRIES:
+        _REGISTRIES[wn_fname] = Synset_Registry(connect(wn_fname).cursor())
+    return _REGISTRIES[wn_fname]
+
+def get_synsets_by_pos(pos, wn_fname, bulk=True, lazy=False):
     """ Get a list of synsets belonging to a part of speech
 
     Args:
         pos (str): string representing the part of speech for desired synsets
+        bulk (bool, optional): load all synsets with a few joins instead of one query per synset,
+            and share them through the registry of wn_fname
+        lazy (bool, optional): return lazy synsets that are only loaded (together) once used
     
     Returns:
         list of Synset objects with all synsets of a type
@@ -104,14 +374,30 @@ def get_synsets_by_pos(pos, wn_fname):
     if pos not in ["n", "v", "a", "s"]:
         raise Exception("no such pos: %s, must be in {n, v, a, s}" % pos)
 
-    con = sqlite3.connect(wn_fname)
+    if bulk or lazy:
+        return get_registry(wn_fname).by_pos(pos, lazy)
+
+    con = connect(wn_fname)
     wn_db = con.cursor()
 
     wn_db.execute("SELECT synsetid, definition FROM synsets WHERE pos=?", (pos,))
     return [Synset(snid, wn_db, provided_gloss=gloss) for snid, gloss in wn_db.fetchall()]
 
+def get_synsets_by_ids(synsetids, wn_fname, lazy=False):
+    """ Get a list of synsets from their ids, loaded in bulk
+
+    Args:
+        synsetids (list of int): ids of the desired synsets
+        wn_fname (str): the file name of the sql WordNet
+        lazy (bool, optional): return lazy synsets that are only loaded (together) once used
+
+    Returns:
+        list of shared Synset objects in the same order as synsetids
+    """
+    return get_registry(wn_fname).get_many(synsetids, lazy)
+
 def test():
-    con = sqlite3.connect("wordnet_3.1+.db")
+    con = connect("wordnet_3.1+.db")
     wn_db = con.cursor()
     synset = Synset(113679408, wn_db, get_glosss=True)
 
@@ -0,0 +1,113 @@
+import sys, time
+import numpy as np
+
+
+class Synset_Matrix:
+    """ Synset vectors computed once and stored as the rows of a float32 matrix
+
+    Saved as three .npy files that later runs memory map, so loading is instant and processes
+    reading the same file share its pages:
+        <fname>.npy           float32 matrix, row i is the vectorize1 vector of synsetids[i]
+        <fname>.ids.npy       int64 synsetid of each row
+        <fname>.coverage.npy  packed bitmap, bit i is set if a word of synsetids[i] has a vector
+
+    A Synset_Matrix can be passed to Synset.vectorize1 and Synset.is_in in place of the word vectors
+
+    Args:
+        synsetids (np.array of int64): synsetid of each row
+        vectors (np.array of float32): one row per synset
+        covered (np.array of bool): whether each synset has a word with a vector
+    """
+
+    def __init__(self, synsetids, vectors, covered):
+        self.synsetids = synsetids
+        self.vectors = vectors
+        self.covered = covered
+        self.index = dict((sid, i) for i, sid in enumerate(synsetids.tolist()))
+        self._order = None # argsort of synsetids, for rows_of
+
+    @classmethod
+    def build(cls, synsets, word_vectors):
+        """ Vectorizes every synset once
+
+        Args:
+            synsets (list of Synset): synsets to store
+            word_vectors (gensim.KeyedVectors): word vectors to average
+
+        Returns:
+            Synset_Matrix with one row per distinct synset
+        """
+        unique = dict((s.synsetid, s) for s in synsets)
+        synsetids = np.array(sorted(unique), dtype=np.int64)
+        dim = word_vectors[next(iter(word_vectors.vocab))].shape[0]
+        vectors = np.zeros((len(synsetids), dim), dtype=np.float32)
+        covered = np.zeros(len(synsetids), dtype=bool)
+        for i, sid in enumerate(synsetids.tolist()):
+            synset = unique[sid]
+            if synset.is_in(word_vectors):
+                vectors[i] = synset.vectorize1(word_vectors)
+                covered[i] = True
+        return cls(synsetids, vectors, covered)
+
+    @classmethod
+    def load(cls, fname, mmap=True):
+        """ Loads a saved matrix, memory mapping the vectors unless mmap is False """
+        vectors = np.load(fname + ".npy", mmap_mode="r" if mmap else None)
+        synsetids = np.load(fname + ".ids.npy")
+        covered = np.unpackbits(np.load(fname + ".coverage.npy"))[:len(synsetids)].astype(bool)
+        return cls(synsetids, vectors, covered)
+
+    def save(self, fname):
+        np.save(fname + ".npy", np.asarray(self.vectors, dtype=np.float32))
+        np.save(fname + ".ids.npy", self.synsetids)
+        np.save(fname + ".coverage.npy", np.packbits(self.covered))
+
+    def __len__(self):
+        return len(self.synsetids)
+
+    def __contains__(self, synsetid):
+        return synsetid in self.index
+
+    def row(self, synsetid):
+        """ row of synsetid, -1 if it is not stored """
+        return self.index.get(synsetid, -1)
+
+    def rows_of(self, synsetids):
+        """ row of each of an array of synsetids, -1 for the ones that are not stored """
+        synsetids = np.asarray(synsetids, dtype=np.int64)
+        if len(self.synsetids) == 0:
+            return np.full(synsetids.shape, -1, dtype=np.int64)
+        if self._order is None:
+            self._order = np.argsort(self.synsetids, kind="mergesort")
+        sorted_ids = self.synsetids[self._order]
+        at = np.minimum(np.searchsorted(sorted_ids, synsetids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[at] == synsetids, self._order[at], -1)
+
+    def covers(self, synsetid):
+        """ same as Synset.is_in(word_vectors) for the word vectors the matrix was built from """
+        i = self.index.get(synsetid, -1)
+        return i >= 0 and bool(self.covered[i])
+
+    def vector(self, synsetid):
+        """ same as Synset.vectorize1(word_vectors), a zero vector for synsets that are not covered """
+        i = self.index.get(synsetid, -1)
+        if i < 0:
+            return np.zeros(self.vectors.shape[1], dtype=np.float32)
+        return np.asarray(self.vectors[i])
+
+
+def main(args):
+    from synset import get_synsets_by_pos
+    from word_store import load_word_vectors
+    wn_fname, vectors_fname, out_fname = args[0], args[1], args[2]
+    start = time.time()
+    word_vectors = load_word_vectors(vectors_fname)
+    synsets = []
+    for pos in ["n", "v", "a", "s"]:
+        synsets += get_synsets_by_pos(pos, wn_fname)
+    matrix = Synset_Matrix.build(synsets, word_vectors)
+    matrix.save(out_fname)
+    print "%d synsets (%d covered) vectorized in %.1fs" % (len(matrix), matrix.covered.sum(), time.time() - start)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
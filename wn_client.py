@@ -0,0 +1,150 @@
+import sys, time, json, socket, random, threading
+from wn_service import PORT
+
+
+class Wn_Client:
+    """ Client of a Wn_Service
+
+    Args:
+        host (str, optional): host the service runs on
+        port (int, optional): port the service listens on
+    """
+
+    def __init__(self, host="127.0.0.1", port=PORT):
+        self.sock = socket.create_connection((host, port))
+        self.reader = self.sock.makefile("rb")
+        self.next_id = 0
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    def _send(self, requests):
+        lines = []
+        for op, args in requests:
+            self.next_id += 1
+            lines.append(json.dumps({"id": self.next_id, "op": op, "args": args}))
+        self.sock.sendall("\n".join(lines) + "\n")
+
+    def _receive(self):
+        response = json.loads(self.reader.readline())
+        if "error" in response:
+            raise Exception(response["error"])
+        return response["result"]
+
+    def call(self, op, **args):
+        """ sends one request and waits for its result """
+        self._send([(op, args)])
+        return self._receive()
+
+    def batch(self, requests):
+        """ sends many (op, args) requests at once, so the service can batch them, and returns their results in order """
+        self._send(requests)
+        return [self._receive() for _ in requests]
+
+    def senses(self, word):
+        return self.call("senses", word=word)
+
+    def synsetids(self, word):
+        return self.call("synsetids", word=word)
+
+    def dist(self, src, dst, link_typ="", max_dist=12):
+        return self.call("dist", src=src, dst=dst, link_typ=link_typ, max_dist=max_dist)
+
+    def dists(self, src, dsts, link_typ="", max_dist=12):
+        return dict(self.call("dists", src=src, dsts=list(dsts), link_typ=link_typ, max_dist=max_dist))
+
+    def nearest(self, synsetid, pos="n", n=15):
+        return [tuple(p) for p in self.call("nearest", synsetid=synsetid, pos=pos, n=n)]
+
+    def proposals(self, link, pos_from, pos_to, synsetid, direction="to"):
+        return [tuple(p) for p in self.call("proposals", link=link, pos_from=pos_from, pos_to=pos_to,
+                synsetid=synsetid, direction=direction)]
+
+    def stats(self):
+        return self.call("stats")
+
+
+def _percentile(values, p):
+    """ nearest rank percentile of sorted values """
+    return values[max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))]
+
+def load_test(requests, n_clients=8, n_requests=1000, host="127.0.0.1", port=PORT, seed=0):
+    """ Sends requests from concurrent clients, each waiting for its answer before the next request
+
+    Args:
+        requests (list of tuple): (op, args) to pick from at random
+        n_clients (int, optional): number of concurrent clients, one thread each
+        n_requests (int, optional): requests sent by each client
+
+    Returns:
+        dict with the latency percentiles in ms, requests per second and errors
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run(i):
+        rand = random.Random(seed + i)
+        client = Wn_Client(host, port)
+        mine = []
+        n_errors = 0
+        for _ in xrange(n_requests):
+            op, args = rand.choice(requests)
+            start = time.time()
+            try:
+                client.call(op, **args)
+            except Exception:
+                n_errors += 1
+            mine.append(time.time() - start)
+        client.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += n_errors
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in xrange(n_clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+    latencies.sort()
+    return {
+        "clients": n_clients,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "seconds": seconds,
+        "requests_per_second": len(latencies) / seconds,
+        "latency_ms": dict(("p%d" % p, 1000 * _percentile(latencies, p)) for p in (50, 90, 99)),
+        "max_latency_ms": 1000 * latencies[-1],
+    }
+
+
+def main(args):
+    """ wn_client.py <wn file> [clients] [requests per client] [port]
+
+    load tests a running Wn_Service with sense, distance and nearest queries on synsets of the WordNet
+    """
+    from wn_sql import connect
+    n_clients = int(args[1]) if len(args) > 1 else 8
+    n_requests = int(args[2]) if len(args) > 2 else 500
+    port = int(args[3]) if len(args) > 3 else PORT
+    wn_db = connect(args[0]).cursor()
+    wn_db.execute("SELECT synsetid FROM synsets WHERE pos='n' ORDER BY random() LIMIT 1000")
+    nouns = [row[0] for row in wn_db.fetchall()]
+    wn_db.execute("SELECT lemma FROM words ORDER BY random() LIMIT 1000")
+    words = [row[0] for row in wn_db.fetchall()]
+    rand = random.Random(0)
+    requests = [("senses", {"word": w}) for w in words[:200]]
+    requests += [("dist", {"src": rand.choice(nouns), "dst": rand.choice(nouns)}) for _ in xrange(200)]
+    requests += [("nearest", {"synsetid": s, "pos": "n"}) for s in nouns[:200]]
+    for op in ["senses", "dist", "nearest", None]:
+        chosen = [r for r in requests if op is None or r[0] == op]
+        report = load_test(chosen, n_clients, n_requests, port=port)
+        print "%-8s %6d requests %3d errors %8.1f req/s  p50 %6.2f ms  p90 %6.2f ms  p99 %6.2f ms" % (op or "mixed",
+                report["requests"], report["errors"], report["requests_per_second"], report["latency_ms"]["p50"],
+                report["latency_ms"]["p90"], report["latency_ms"]["p99"])
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,318 @@
+import sys, os, time, random, sqlite3
+import numpy as np
+from wn_sql import INDEXES
+
+# (linkid, link, linktype, pos of synset1, pos of synset2, reverse link) of the generated semantic links,
+# hypernym and hyponym are generated as trees so they are not listed
+EXTRA_LINKS = [
+    (11, "part holonym", "sem", "n", "n", 12),
+    (13, "member holonym", "sem", "n", "n", 14),
+    (21, "entail", "sem", "v", "v", None),
+    (23, "cause", "sem", "v", "v", None),
+    (40, "similar", "sem", "a", "s", 40),
+    (50, "also", "sem", "v", "v", None),
+    (60, "attribute", "sem", "n", "a", 60),
+    (70, "verb group", "sem", "v", "v", 70),
+    (100, "action", "sem", "n", "v", None),
+]
+LINKTYPES = [
+    (1, "hypernym", 1, "sem"),
+    (2, "hyponym", 1, "sem"),
+    (11, "part holonym", 1, "sem"),
+    (12, "part meronym", 1, "sem"),
+    (13, "member holonym", 1, "sem"),
+    (14, "member meronym", 1, "sem"),
+    (21, "entail", 1, "sem"),
+    (23, "cause", 1, "sem"),
+    (30, "antonym", 0, "lex"),
+    (40, "similar", 0, "sem"),
+    (50, "also", 0, "sem"),
+    (60, "attribute", 0, "sem"),
+    (70, "verb group", 0, "sem"),
+    (81, "derivation", 0, "lex"),
+    (100, "action", 0, "sem"),
+]
+
+# share of each pos among synsets, roughly that of WordNet 3.1
+POS_SHARE = [("n", 0.70), ("v", 0.12), ("a", 0.06), ("s", 0.09), ("r", 0.03)]
+SS_TYPE = {"n": 1, "v": 2, "a": 3, "r": 4, "s": 5}
+SYNSETID_BASE = {"n": 100000000, "v": 200000000, "a": 300000000, "s": 300000000, "r": 400000000}
+SYLLABLES = ["ka", "lo", "mi", "nu", "pe", "ra", "si", "to", "ve", "zu", "bra", "cle", "dor", "fen", "gu",
+        "hal", "jin", "kor", "lum", "mar", "nel", "pol", "qua", "rin", "sto", "tra", "ul", "vo", "wex", "yar"]
+
+SCHEMA = [
+    "CREATE TABLE synsets (synsetid INTEGER PRIMARY KEY, pos TEXT, lexdomainid INTEGER, definition TEXT)",
+    "CREATE TABLE words (wordid INTEGER PRIMARY KEY, lemma TEXT)",
+    "CREATE TABLE senses (wordid INTEGER, casedwordid INTEGER, synsetid INTEGER, senseid INTEGER PRIMARY KEY, "
+            "sensenum INTEGER, lexid INTEGER, tagcount INTEGER, old_sensekey TEXT, sensekey TEXT)",
+    "CREATE TABLE semlinks (synset1id INTEGER, synset2id INTEGER, linkid INTEGER)",
+    "CREATE TABLE linktypes (linkid INTEGER PRIMARY KEY, link TEXT, recurses INTEGER, linktype TEXT)",
+    "CREATE TABLE morphs (morphid INTEGER PRIMARY KEY, morph TEXT)",
+    "CREATE TABLE morphmaps (wordid INTEGER, pos TEXT, morphid INTEGER)",
+]
+
+
+def _pseudo_words(n, rand):
+    """ n distinct made up words of 2 to 4 syllables """
+    words = set()
+    while len(words) < n:
+        words.add("".join(rand.choice(SYLLABLES) for _ in xrange(rand.randint(2, 4))))
+    return sorted(words)
+
+def make_wordnet(wn_fname, n_synsets=10000, density=1.0, seed=0, indexes=True):
+    """ Writes a made up WordNet with the schema of the sql WordNet the rest of the code reads
+
+    Nouns and verbs get hypernym/hyponym trees, and every synset gets about density other semantic
+    links (half of them to a synset close to it in the tree order, so the graph has local structure).
+    Common lemmas are shared by many synsets, so there are polysemous words to disambiguate.
+
+    Args:
+        wn_fname (str): file to write, replaced if it exists
+        n_synsets (int, optional): number of synsets
+        density (float, optional): semantic links per synset besides the hypernym trees
+        seed (int, optional): random seed, the same arguments always give the same database
+        indexes (bool, optional): create wn_sql.INDEXES like a provisioned database
+
+    Returns:
+        dict with the number of synsets, words, senses and semlinks
+    """
+    rand = random.Random(seed)
+    if os.path.exists(wn_fname):
+        os.remove(wn_fname)
+    con = sqlite3.connect(wn_fname)
+    for statement in SCHEMA:
+        con.execute(statement)
+    con.executemany("INSERT INTO linktypes VALUES (?, ?, ?, ?)", LINKTYPES)
+
+    # synsets
+    by_pos = dict((pos, []) for pos, _ in POS_SHARE)
+    offsets = dict()
+    for pos, share in POS_SHARE:
+        for _ in xrange(max(1, int(n_synsets * share))):
+            base = SYNSETID_BASE[pos]
+            offsets[base] = offsets.get(base, 0) + 1
+            by_pos[pos].append(base + offsets[base])
+
+    # lemmas, picked with a skew so low indices are common and polysemous
+    lemmas = _pseudo_words(int(n_synsets * 0.8) + 10, rand)
+    n_single = len(lemmas)
+    for _ in xrange(n_single // 10):
+        lemmas.append("%s %s" % (rand.choice(lemmas[:n_single]), rand.choice(lemmas[:n_single])))
+    lemmas = sorted(set(lemmas))
+    rand.shuffle(lemmas)
+    con.executemany("INSERT INTO words VALUES (?, ?)", ((i + 1, lemma) for i, lemma in enumerate(lemmas)))
+
+    senses = []
+    sense_counts = dict() # (wordid, pos) -> senses so far
+    synset_rows = []
+    for pos, synsetids in sorted(by_pos.iteritems()):
+        for synsetid in synsetids:
+            chosen = set()
+            for _ in xrange(1 + min(int(rand.expovariate(1.2)), 5)):
+                chosen.add(int(len(lemmas) * rand.random() ** 1.5))
+            for i in sorted(chosen):
+                wordid = i + 1
+                sensenum = sense_counts.get((wordid, pos), 0) + 1
+                sense_counts[(wordid, pos)] = sensenum
+                key = "%s%%%d:%02d:%02d::" % (lemmas[i].replace(" ", "_"), SS_TYPE[pos], 0, sensenum - 1)
+                senses.append((wordid, None, synsetid, len(senses) + 1, sensenum, sensenum - 1,
+                        rand.randint(0, 3), key, key))
+            gloss = " ".join(lemmas[int(len(lemmas) * rand.random() ** 2)] for _ in xrange(rand.randint(4, 12)))
+            synset_rows.append((synsetid, pos, rand.randint(0, 44), gloss))
+    con.executemany("INSERT INTO synsets VALUES (?, ?, ?, ?)", synset_rows)
+    con.executemany("INSERT INTO senses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", senses)
+
+    # hypernym trees, each synset's hypernym is an earlier synset
+    links = []
+    for pos in ["n", "v"]:
+        synsetids = by_pos[pos]
+        n_roots = max(1, len(synsetids) // 2000)
+        for i in xrange(n_roots, len(synsetids)):
+            parent = synsetids[rand.randrange(max(0, i - 500) if rand.random() < 0.7 else 0, i)]
+            links.append((synsetids[i], parent, 1))
+            links.append((parent, synsetids[i], 2))
+
+    # other links, half of them local
+    for _ in xrange(int(n_synsets * density)):
+        linkid, _, _, pos1, pos2, reverse = rand.choice(EXTRA_LINKS)
+        i = rand.randrange(len(by_pos[pos1]))
+        if rand.random() < 0.5:
+            j = int(float(i) / len(by_pos[pos1]) * len(by_pos[pos2])) + rand.randint(-20, 20)
+            j = min(max(j, 0), len(by_pos[pos2]) - 1)
+        else:
+            j = rand.randrange(len(by_pos[pos2]))
+        s1, s2 = by_pos[pos1][i], by_pos[pos2][j]
+        if s1 == s2:
+            continue
+        links.append((s1, s2, linkid))
+        if reverse is not None:
+            links.append((s2, s1, reverse))
+    con.executemany("INSERT INTO semlinks VALUES (?, ?, ?)", links)
+
+    # inflected forms of single word noun and verb lemmas
+    known = set(lemmas)
+    morphs = dict()
+    morphmaps = []
+    for wordid, pos in sorted(sense_counts):
+        lemma = lemmas[wordid - 1]
+        if " " in lemma or pos not in ["n", "v"] or rand.random() < 0.5:
+            continue
+        for form in ([lemma + "s"] if pos == "n" else [lemma + "ed", lemma + "ing"]):
+            if form in known:
+                continue
+            if form not in morphs:
+                morphs[form] = len(morphs) + 1
+            morphmaps.append((wordid, pos, morphs[form]))
+    con.executemany("INSERT INTO morphs VALUES (?, ?)", ((i, form) for form, i in morphs.iteritems()))
+    con.executemany("INSERT INTO morphmaps VALUES (?, ?, ?)", morphmaps)
+
+    if indexes:
+        for name, table, columns in INDEXES:
+            con.execute("CREATE INDEX %s ON %s(%s)" % (name, table, ", ".join(columns)))
+        con.execute("ANALYZE")
+    con.commit()
+    con.close()
+    return {"synsets": len(synset_rows), "words": len(lemmas), "senses": len(senses), "semlinks": len(links)}
+
+def make_vectors(wn_fname, bin_fname, dim=50, coverage=0.9, n_extra=1000, seed=0):
+    """ Writes a binary word2vec file (the format of GoogleNews-vectors-negative300.bin) for a made up WordNet
+
+    Every synset gets a direction close to the direction of its hypernym, or of a synset it is
+    linked to, and each word vector is the sum of the directions of its synsets plus noise, so
+    linked synsets have similar vectors like they do with real word vectors.
+
+    Args:
+        wn_fname (str): the made up WordNet
+        bin_fname (str): file to write
+        dim (int, optional): vector size
+        coverage (float, optional): share of the WordNet words that get a vector
+        n_extra (int, optional): number of words added that are not in the WordNet
+        seed (int, optional): random seed
+
+    Returns:
+        number of words written
+    """
+    rs = np.random.RandomState(seed)
+    con = sqlite3.connect(wn_fname)
+    synsetids = [row[0] for row in con.execute("SELECT synsetid FROM synsets ORDER BY synsetid")]
+    row = dict((sid, i) for i, sid in enumerate(synsetids))
+    directions = rs.randn(len(synsetids), dim).astype(np.float32)
+
+    # synset1id is the hyponym of hypernym links, visiting them in id order visits parents first
+    parent = dict(con.execute("SELECT synset1id, synset2id FROM semlinks WHERE linkid=1"))
+    for s1, s2 in con.execute("SELECT synset1id, synset2id FROM semlinks WHERE linkid != 1 AND linkid != 2"):
+        parent.setdefault(s1, s2)
+    for sid in synsetids:
+        p = parent.get(sid)
+        if p is not None and p < sid:
+            directions[row[sid]] = directions[row[p]] + 0.6 * directions[row[sid]]
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+
+    words = dict()
+    for sensekey, synsetid in con.execute("SELECT old_sensekey, synsetid FROM senses"):
+        word = sensekey.split("%")[0]
+        words.setdefault(word, []).append(row[synsetid])
+    con.close()
+    kept = sorted(w for w in words if rs.rand() < coverage)
+    extra = ["zz%s%d" % (SYLLABLES[i % len(SYLLABLES)], i) for i in xrange(n_extra)]
+
+    with open(bin_fname, "wb") as f:
+        f.write("%d %d\n" % (len(kept) + len(extra), dim))
+        for word in kept + extra:
+            if word in words:
+                vector = directions[words[word]].sum(axis=0) + 0.3 * rs.randn(dim)
+            else:
+                vector = rs.randn(dim)
+            f.write(word.encode("utf8") + b" ")
+            f.write(np.asarray(vector, dtype=np.float32).tobytes())
+            f.write(b"\n")
+    return len(kept) + len(extra)
+
+def make_testcases(wn_fname, fname, n_cases=500, context_size=8, noise=0.25, seed=0):
+    """ Writes WsdTester test cases for a made up WordNet
+
+    The target is a polysemous lemma, and the context words are mostly lemmas of synsets within a
+    couple of links of the correct sense, so the graph heuristics have something to find.
+
+    Args:
+        wn_fname (str): the made up WordNet
+        fname (str): file to write
+        n_cases (int, optional): number of test cases
+        context_size (int, optional): context words around the target, rounded up to even
+        noise (float, optional): share of the context words picked at random
+        seed (int, optional): random seed
+
+    Returns:
+        number of test cases written
+    """
+    from wn_graph import Wn_Graph
+    rand = random.Random(seed)
+    con = sqlite3.connect(wn_fname)
+    wn_db = con.cursor()
+    graph = Wn_Graph.from_db(wn_db)
+    lemmas = dict()
+    senses = dict() # (wordid, pos) -> list of (sensekey, synsetid)
+    synset_lemmas = dict()
+    for wordid, lemma in wn_db.execute("SELECT wordid, lemma FROM words"):
+        lemmas[wordid] = lemma
+    for wordid, synsetid, sensekey, pos in wn_db.execute(
+            "SELECT wordid, senses.synsetid, old_sensekey, pos FROM senses JOIN synsets ON senses.synsetid = synsets.synsetid"):
+        senses.setdefault((wordid, pos), []).append((sensekey, synsetid))
+        if " " not in lemmas[wordid]:
+            synset_lemmas.setdefault(synsetid, []).append(lemmas[wordid])
+    con.close()
+
+    tags = {"n": "NOUN", "v": "VERB", "a": "ADJ", "r": "ADV"}
+    single = [lemma for lemma in lemmas.itervalues() if " " not in lemma]
+    ambiguous = sorted(k for k, v in senses.iteritems() if len(v) > 1 and k[1] in tags and " " not in lemmas[k[0]])
+    half = (context_size + 1) // 2
+    cases = []
+    while len(cases) < n_cases and ambiguous:
+        wordid, pos = rand.choice(ambiguous)
+        sensekey, synsetid = rand.choice(senses[(wordid, pos)])
+        near = set()
+        if synsetid in graph:
+            frontier = set([graph.index[synsetid]])
+            for _ in xrange(2):
+                frontier = graph.expand(frontier)
+                near |= frontier
+        nearby = [w for i in near for w in synset_lemmas.get(graph.synsetids[i], []) if w != lemmas[wordid]]
+        context = [rand.choice(nearby) if nearby and rand.random() >= noise else rand.choice(single)
+                for _ in xrange(2 * half)]
+        context.insert(half, lemmas[wordid])
+        cases.append("%s,%s,%s" % (" ".join(context), sensekey, tags[pos]))
+
+    with open(fname, "w") as f:
+        f.write("\n".join(cases))
+    return len(cases)
+
+def make_fixture(out_dir, n_synsets=10000, density=1.0, dim=50, n_cases=500, seed=0):
+    """ make_wordnet, make_vectors and make_testcases into out_dir as wordnet.db, vectors.bin and testcases
+
+    Returns:
+        (wn_fname, bin_fname, testcases_fname)
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    wn_fname = os.path.join(out_dir, "wordnet.db")
+    bin_fname = os.path.join(out_dir, "vectors.bin")
+    testcases_fname = os.path.join(out_dir, "testcases")
+    make_wordnet(wn_fname, n_synsets, density, seed)
+    make_vectors(wn_fname, bin_fname, dim, seed=seed)
+    make_testcases(wn_fname, testcases_fname, n_cases, seed=seed)
+    return wn_fname, bin_fname, testcases_fname
+
+
+def main(args):
+    """ wn_fixture.py <out dir> [n synsets] [density] [dim] [n test cases] """
+    out_dir = args[0]
+    n_synsets = int(args[1]) if len(args) > 1 else 10000
+    density = float(args[2]) if len(args) > 2 else 1.0
+    dim = int(args[3]) if len(args) > 3 else 50
+    n_cases = int(args[4]) if len(args) > 4 else 500
+    start = time.time()
+    wn_fname, bin_fname, testcases_fname = make_fixture(out_dir, n_synsets, density, dim, n_cases)
+    print "wrote %s, %s and %s in %.1fs" % (wn_fname, bin_fname, testcases_fname, time.time() - start)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
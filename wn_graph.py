@@ -0,0 +1,119 @@
+import sys, time
+from array import array
+from wn_sql import connect
+
+
+class Wn_Graph:
+    """ An in memory adjacency structure of the semantic links between synsets
+
+    Synsets are given a dense index, the neighbors of the synset with index i are
+    neighbors[offsets[i]:offsets[i + 1]] (compressed sparse rows). Links are stored in
+    both directions so the graph matches Wn_Searchable.get_linked_synsets
+
+    Args:
+        edges (iterable of tuple): (synset1id, synset2id) pairs of linked synsets
+
+    Attributes:
+        synsetids (array of int): synsetid of each dense index
+        index (dict): synsetid to dense index
+        offsets (array of int): start of each synset's neighbors, has len(synsetids) + 1 entries
+        neighbors (array of int): dense indices of the neighbors of every synset
+    """
+
+    def __init__(self, edges):
+        self.index = dict()
+        self.synsetids = array('l')
+        pairs = set()
+        for s1, s2 in edges:
+            i1 = self._add(s1)
+            i2 = self._add(s2)
+            pairs.add((i1, i2) if i1 <= i2 else (i2, i1))
+
+        # count degrees then fill each row in place
+        n = len(self.synsetids)
+        degree = [0] * n
+        for i1, i2 in pairs:
+            degree[i1] += 1
+            if i1 != i2:
+                degree[i2] += 1
+        self.offsets = array('i', [0]) * (n + 1)
+        for i in xrange(n):
+            self.offsets[i + 1] = self.offsets[i] + degree[i]
+        self.neighbors = array('i', [0]) * self.offsets[n]
+        fill = array('i', self.offsets[:n])
+        for i1, i2 in sorted(pairs):
+            self.neighbors[fill[i1]] = i2
+            fill[i1] += 1
+            if i1 != i2:
+                self.neighbors[fill[i2]] = i1
+                fill[i2] += 1
+
+    def _add(self, synsetid):
+        i = self.index.get(synsetid)
+        if i is None:
+            i = len(self.synsetids)
+            self.index[synsetid] = i
+            self.synsetids.append(synsetid)
+        return i
+
+    @classmethod
+    def from_db(cls, wn_db, linkids=None):
+        """ Loads the semantic links with a single query
+
+        Args:
+            wn_db (sqlite cursor): a sqlite cursor that can access WordNet information
+            linkids (set of int, optional): only load links with these linkids, all links if None
+
+        Returns:
+            Wn_Graph of the semlinks table
+        """
+        if linkids is None:
+            wn_db.execute("SELECT synset1id, synset2id FROM semlinks")
+        else:
+            linkids = sorted(linkids)
+            wn_db.execute("SELECT synset1id, synset2id FROM semlinks WHERE linkid IN ({0})".format(
+                    ", ".join("?" for _ in linkids)), linkids)
+        return cls(wn_db.fetchall())
+
+    def __len__(self):
+        return len(self.synsetids)
+
+    def __contains__(self, synsetid):
+        return synsetid in self.index
+
+    def neighbor_indices(self, i):
+        """ dense indices of the neighbors of the synset with dense index i """
+        return self.neighbors[self.offsets[i]:self.offsets[i + 1]]
+
+    def expand(self, frontier):
+        """ dense indices of all neighbors of the dense indices in frontier """
+        offsets, neighbors = self.offsets, self.neighbors
+        connected = set()
+        for i in frontier:
+            connected.update(neighbors[offsets[i]:offsets[i + 1]])
+        return connected
+
+    def linked_synsets(self, synsetid):
+        """ same as Wn_Searchable.get_linked_synsets without any queries
+
+        Args:
+            synsetid (int): the synset to find neighbors of
+
+        Returns:
+            set of synsetids linked to synsetid
+        """
+        i = self.index.get(synsetid)
+        if i is None:
+            return set()
+        ids = self.synsetids
+        return set(ids[j] for j in self.neighbors[self.offsets[i]:self.offsets[i + 1]])
+
+
+def main(args):
+    con = connect(args[0])
+    start = time.time()
+    graph = Wn_Graph.from_db(con.cursor())
+    print "%d synsets, %d links loaded in %.2fs" % (len(graph), len(graph.neighbors), time.time() - start)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
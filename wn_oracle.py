@@ -0,0 +1,126 @@
+import sys, time
+import numpy as np
+from wn_graph import Wn_Graph
+from wn_sql import connect
+
+UNREACHED = 255 # landmark distances are stored as uint8, 255 means not connected
+
+
+class Distance_Oracle:
+    """ Landmark distance oracle for hop distances between synsets
+
+    Stores the BFS distance from a few landmark synsets to every synset. For synsets s and t
+    and every landmark l the triangle inequality gives
+        |d(l, s) - d(l, t)| <= d(s, t) <= d(l, s) + d(l, t)
+    so a query is answered with the tightest bounds over all landmarks, and is exact when
+    they meet.
+
+    Args:
+        synsetids (np.array of int64): sorted synsetids covered by the oracle
+        landmarks (np.array of int64): synsetids of the landmarks
+        dists (np.array of uint8): dists[l, i] is the distance from landmark l to synsetids[i]
+
+    Attributes:
+        build_time (float): seconds taken by build, None if the oracle was loaded
+    """
+
+    def __init__(self, synsetids, landmarks, dists):
+        self.synsetids = synsetids
+        self.landmarks = landmarks
+        self.dists = dists
+        self.build_time = None
+
+    @classmethod
+    def build(cls, graph, n_landmarks=16):
+        """ Runs one BFS per landmark, the landmarks are the synsets with the most links
+
+        Args:
+            graph (Wn_Graph): graph to build the oracle for
+            n_landmarks (int, optional): number of landmarks
+
+        Returns:
+            Distance_Oracle
+        """
+        start = time.time()
+        n = len(graph)
+        degree = np.diff(np.array(graph.offsets, dtype=np.int64))
+        chosen = np.argsort(-degree, kind="mergesort")[:n_landmarks]
+
+        dists = np.full((len(chosen), n), UNREACHED, dtype=np.uint8)
+        for row, landmark in enumerate(chosen):
+            frontier = set([int(landmark)])
+            seen = set(frontier)
+            dist = 0
+            while frontier and dist < UNREACHED:
+                dists[row, list(frontier)] = dist
+                dist += 1
+                frontier = graph.expand(frontier) - seen
+                seen |= frontier
+
+        # sort columns by synsetid so queries can binary search
+        ids = np.array(graph.synsetids, dtype=np.int64)
+        order = np.argsort(ids, kind="mergesort")
+        oracle = cls(ids[order], ids[chosen], np.ascontiguousarray(dists[:, order]))
+        oracle.build_time = time.time() - start
+        return oracle
+
+    @classmethod
+    def load(cls, fname):
+        data = np.load(fname)
+        return cls(data["synsetids"], data["landmarks"], data["dists"])
+
+    def save(self, fname):
+        np.savez(fname, synsetids=self.synsetids, landmarks=self.landmarks, dists=self.dists)
+
+    @property
+    def nbytes(self):
+        """ size of the index in bytes """
+        return self.synsetids.nbytes + self.landmarks.nbytes + self.dists.nbytes
+
+    def _column(self, synsetid):
+        i = np.searchsorted(self.synsetids, synsetid)
+        if i < len(self.synsetids) and self.synsetids[i] == synsetid:
+            return self.dists[:, i]
+        return None
+
+    def query(self, src, dst):
+        """ Bounds on the distance between two synsets
+
+        Args:
+            src (int): synsetid
+            dst (int): synsetid
+
+        Returns:
+            (lower, upper, exact) where upper is None if no landmark reaches both synsets and
+            exact is True when lower == upper. Synsets that are not connected give (-1, -1, True)
+        """
+        if src == dst:
+            return 0, 0, True
+        ds, dt = self._column(src), self._column(dst)
+        if ds is None or dt is None:
+            return -1, -1, True
+        reach_s, reach_t = ds != UNREACHED, dt != UNREACHED
+        if np.any(reach_s != reach_t):
+            # a landmark reaches one synset but not the other, so they are in different components
+            return -1, -1, True
+        if not np.any(reach_s):
+            return 1, None, False
+        ds = ds[reach_s].astype(np.int32)
+        dt = dt[reach_s].astype(np.int32)
+        lower = max(1, int(np.abs(ds - dt).max()))
+        upper = int((ds + dt).min())
+        return lower, upper, lower == upper
+
+
+def main(args):
+    wn_fname, out_fname = args[0], args[1]
+    n_landmarks = int(args[2]) if len(args) > 2 else 16
+    con = connect(wn_fname)
+    graph = Wn_Graph.from_db(con.cursor())
+    oracle = Distance_Oracle.build(graph, n_landmarks)
+    oracle.save(out_fname)
+    print "%d landmarks over %d synsets built in %.2fs, index size %.1f KB" % (
+            len(oracle.landmarks), len(oracle.synsetids), oracle.build_time, oracle.nbytes / 1024.0)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,11 +1,65 @@
-import sqlite3
-from Queue import Queue
+from wn_sql import connect
+from wn_graph import Wn_Graph
+from wn_oracle import Distance_Oracle
+from synset import get_registry
+from bfs_cache import Bfs_Layers
 
 
 class Wn_Searchable:
-    def __init__(self, wn_fname):
-        con = sqlite3.connect(wn_fname)
+    """ Searches a WordNet sqlite database
+
+    Args:
+        wn_fname (str): the file name of the sql WordNet
+        use_graph (bool, optional): load semlinks once into an in memory Wn_Graph and traverse
+            it instead of querying semlinks for every expanded synset
+        cache (Bfs_Cache, optional): keep the searches of get_dists and get_min_dist_to_set so later
+            queries from the same source are looked up or resume the search
+
+    The link_typ argument of the traversal methods is a link name from linktypes (e.g.
+    "hypernym"), a list or set of link names, or "" for every semantic link
+    """
+    def __init__(self, wn_fname, use_graph=False, cache=None):
+        con = connect(wn_fname)
         self.wn_db = con.cursor()
+        self.registry = get_registry(wn_fname)
+        self.use_graph = use_graph
+        self._linkids = dict() # link_typ -> frozenset of linkids (None for all links)
+        self._graphs = dict() # frozenset of linkids -> Wn_Graph restricted to those links
+        self._oracles = dict() # frozenset of linkids -> Distance_Oracle built on those links
+        self._synsetids = dict() # word -> synsetids, memoized get_synsetids
+        self.cache = cache
+        self.n_expanded = 0 # synsets expanded by all searches so far
+        self.graph = self.get_graph("") if use_graph else None
+
+    def get_linkids(self, link_typ):
+        """ Resolves link_typ through linktypes
+
+            Args:
+                link_typ (str or iterable of str): link name(s), "" or None for all links
+
+            Return:
+                frozenset of linkids, None if link_typ means every link
+        """
+        if not link_typ:
+            return None
+        key = link_typ if isinstance(link_typ, basestring) else frozenset(link_typ)
+        if key not in self._linkids:
+            links = [key] if isinstance(key, basestring) else sorted(key)
+            self.wn_db.execute("SELECT link, linkid FROM linktypes WHERE link IN ({0})".format(
+                    ", ".join("?" for _ in links)), links)
+            found = dict(self.wn_db.fetchall())
+            missing = set(links) - set(found)
+            if missing:
+                raise Exception("no such link type: %s" % ", ".join(sorted(missing)))
+            self._linkids[key] = frozenset(found.itervalues())
+        return self._linkids[key]
+
+    def get_graph(self, link_typ):
+        """ Returns the Wn_Graph of the links of type link_typ, built once per set of linkids """
+        linkids = self.get_linkids(link_typ)
+        if linkids not in self._graphs:
+            self._graphs[linkids] = Wn_Graph.from_db(self.wn_db, linkids)
+        return self._graphs[linkids]
 
     def find_synsets(self, words):
         """ given a list of words it will find synsets
@@ -24,82 +78,341 @@ class Wn_Searchable:
         return self.wn_db.fetchone()[0]
 
     def get_synsetids(self, word):
+        if word in self._synsetids:
+            return set(self._synsetids[word])
         self.wn_db.execute("SELECT synsetid FROM senses WHERE wordid IN (SELECT wordid FROM morphmaps WHERE morphid IN (SELECT morphid FROM morphs WHERE morph=?) UNION ALL SELECT wordid FROM words WHERE lemma=?)", (word,word,))
-        return set([t[0] for t in self.wn_db.fetchall()])
+        self._synsetids[word] = frozenset(t[0] for t in self.wn_db.fetchall())
+        return set(self._synsetids[word])
 
     def get_linked_synsets(self, src, link_typ):
-        self.wn_db.execute("SELECT synset2id FROM semlinks WHERE synset1id=?", (src,))
-        connected = self.wn_db.fetchall()
-        self.wn_db.execute("SELECT synset1id FROM semlinks WHERE synset2id=?", (src,))
-        connected += self.wn_db.fetchall()
+        if self.use_graph:
+            return self.get_graph(link_typ).linked_synsets(src)
+        linkids = self.get_linkids(link_typ)
+        if linkids is None:
+            self.wn_db.execute("SELECT synset2id FROM semlinks WHERE synset1id=?", (src,))
+            connected = self.wn_db.fetchall()
+            self.wn_db.execute("SELECT synset1id FROM semlinks WHERE synset2id=?", (src,))
+            connected += self.wn_db.fetchall()
+        else:
+            linkids = sorted(linkids)
+            marks = ", ".join("?" for _ in linkids)
+            self.wn_db.execute("SELECT synset2id FROM semlinks WHERE synset1id=? AND linkid IN ({0})".format(marks), [src] + linkids)
+            connected = self.wn_db.fetchall()
+            self.wn_db.execute("SELECT synset1id FROM semlinks WHERE synset2id=? AND linkid IN ({0})".format(marks), [src] + linkids)
+            connected += self.wn_db.fetchall()
         return set([a[0] for a in connected])
 
+    def get_synset(self, synsetid):
+        """ the shared Synset of synsetid """
+        return self.registry.get(synsetid)
+
     def get_gloss(self, synsetid):
         self.wn_db.execute("SELECT definition FROM synsets WHERE synsetid=?", (synsetid,))
         return self.wn_db.fetchone()[0]
 
-    def get_dist(self, src, dst, link_typ=""):
+    def load_oracle(self, oracle, link_typ=""):
+        """ Answer get_dist and get_dists from a Distance_Oracle where its bounds are exact
+
+            Args:
+                oracle (Distance_Oracle or str): the oracle or the file it was saved to
+                link_typ (str, optional): the links the oracle was built on
+        """
+        if isinstance(oracle, basestring):
+            oracle = Distance_Oracle.load(oracle)
+        self._oracles[self.get_linkids(link_typ)] = oracle
+
+    def _oracle_bounds(self, src, dst, link_typ):
+        """ (lower, upper, exact) from the oracle loaded for link_typ, None if there is none """
+        oracle = self._oracles.get(self.get_linkids(link_typ))
+        if oracle is None:
+            return None
+        return oracle.query(src, dst)
+
+    def _search_space(self, link_typ):
+        """ Returns (expand, encode, decode) for the search engine
+
+            expand maps a frontier (set of nodes) to the set of all their neighbors. On the graph
+            backend nodes are dense indices, encode/decode translate them from/to synsetids (encode
+            gives None for synsets without links). On the sql backend nodes are synsetids
+        """
+        if self.use_graph:
+            graph = self.get_graph(link_typ)
+            def expand(frontier):
+                self.n_expanded += len(frontier)
+                return graph.expand(frontier)
+            return expand, graph.index.get, graph.synsetids.__getitem__
+        def expand(frontier):
+            self.n_expanded += len(frontier)
+            connected = set()
+            for synsetid in frontier:
+                connected |= self.get_linked_synsets(synsetid, link_typ)
+            return connected
+        identity = lambda synsetid: synsetid
+        return expand, identity, identity
+
+    def _neighbors(self, link_typ):
+        """ Returns (neighbors, encode, decode) where neighbors gives the nodes linked to one node,
+            nodes are the same as in _search_space """
+        if self.use_graph:
+            graph = self.get_graph(link_typ)
+            def neighbors(node):
+                self.n_expanded += 1
+                return graph.neighbor_indices(node)
+            return neighbors, graph.index.get, graph.synsetids.__getitem__
+        def neighbors(synsetid):
+            self.n_expanded += 1
+            return self.get_linked_synsets(synsetid, link_typ)
+        identity = lambda synsetid: synsetid
+        return neighbors, identity, identity
+
+    def _search_multi(self, srcs, dsts, link_typ, max_dist, first_only=False):
+        """ _search from every synset in srcs at once
+
+            Every reached node is labelled with a bitmask of the sources that reached it, a node is
+            expanded once per level for all the sources newly reaching it, so sources sharing a
+            neighbourhood explore it together. A source stops once it has found all of dsts (or
+            any of them if first_only)
+
+            Return:
+                list with a dict of dst -> distance for each src, the dsts found within max_dist
+        """
+        found = [dict() for _ in srcs]
+        neighbors, encode, decode = self._neighbors(link_typ)
+        targets = dict() # node -> dst
+        for dst in dsts:
+            node = encode(dst)
+            if node is not None:
+                targets[node] = dst
+
+        reached = dict() # node -> mask of the sources that reached it
+        frontier = dict() # node -> mask of the sources that reached it at the current level
+        remaining = [] # number of targets each source has not found
+        active = 0
+        for i, src in enumerate(srcs):
+            bit = 1 << i
+            node = encode(src)
+            remaining.append(len(targets) - (1 if node in targets else 0))
+            if src in dsts:
+                found[i][src] = 0
+                if first_only:
+                    continue
+            if node is None or remaining[i] == 0:
+                continue
+            frontier[node] = frontier.get(node, 0) | bit
+            reached[node] = reached.get(node, 0) | bit
+            active |= bit
+
+        dist = 0
+        while frontier and active and dist < max_dist:
+            dist += 1
+            next_frontier = dict()
+            for node, mask in frontier.iteritems():
+                for neighbor in neighbors(node):
+                    new = mask & ~reached.get(neighbor, 0)
+                    if new:
+                        reached[neighbor] = reached.get(neighbor, 0) | new
+                        next_frontier[neighbor] = next_frontier.get(neighbor, 0) | new
+
+            done = 0
+            for node in targets.viewkeys() & next_frontier.viewkeys():
+                mask = next_frontier[node]
+                i = 0
+                while mask:
+                    if mask & 1:
+                        found[i][targets[node]] = dist
+                        remaining[i] -= 1
+                        if first_only or remaining[i] == 0:
+                            done |= 1 << i
+                    mask >>= 1
+                    i += 1
+            if done:
+                active &= ~done
+                next_frontier = dict((node, mask & active) for node, mask in next_frontier.iteritems() if mask & active)
+            frontier = next_frontier
+        return found
+
+    def get_dists_multi(self, srcs, dsts, link_typ="", max_dist=12):
+        """ get_dists for many sources with one shared search
+
+            Return:
+                list with a dict of distances for each src, only holding the dsts within max_dist
+        """
+        return self._search_multi(srcs, dsts, link_typ, max_dist)
+
+    def get_min_dists_to_set(self, srcs, dst, link_typ="", max_dist=12):
+        """ get_min_dist_to_set for many sources with one shared search
+
+            Return:
+                list with the distance from each src to the closest synset in dst
+        """
+        found = self._search_multi(srcs, dst, link_typ, max_dist, first_only=True)
+        return [min(f.itervalues()) if f else max_dist for f in found]
+
+    def _search(self, src, dsts, link_typ, max_dist, first_only=False):
+        """ Level synchronous search from src for the synsets in dsts
+
+            Return:
+                dict of dst -> distance for the dsts found within max_dist, and whether the search
+                was cut off by max_dist (rather than exhausting src's component)
+        """
+        if self.cache is not None:
+            return self._search_cached(src, dsts, link_typ, max_dist, first_only)
+        found = dict()
+        if src in dsts:
+            found[src] = 0
+            if first_only:
+                return found, False
+        expand, encode, decode = self._search_space(link_typ)
+        start = encode(src)
+        targets = set()
+        for dst in dsts:
+            node = encode(dst)
+            if node is not None and dst != src:
+                targets.add(node)
+        frontier = set([start]) if start is not None else set()
+        seen = set(frontier)
+        dist = 0
+        while frontier and targets and dist < max_dist:
+            dist += 1
+            frontier = expand(frontier) - seen
+            seen |= frontier
+            hit = targets & frontier
+            if hit:
+                targets -= hit
+                for node in hit:
+                    found[decode(node)] = dist
+                if first_only:
+                    return found, False
+        return found, bool(frontier and targets)
+
+    def _search_cached(self, src, dsts, link_typ, max_dist, first_only=False):
+        """ _search answered from the cached layers of src, expanding them further when needed """
+        expand, encode, decode = self._search_space(link_typ)
+        key = (self.get_linkids(link_typ), src)
+        layers = self.cache.get(key)
+        cached = layers is not None
+        if not cached:
+            self.cache.misses += 1
+            layers = Bfs_Layers({src: 0}, set([src]) if encode(src) is not None else set())
+            self.cache.put(key, layers)
+        dists = layers.dists
+        expanded = False
+
+        found = dict()
+        remaining = set() # dsts not reached yet, that the search could still reach
+        for dst in dsts:
+            dist = dists.get(dst)
+            if dist is None:
+                if encode(dst) is not None:
+                    remaining.add(dst)
+            elif dist <= max_dist:
+                found[dst] = dist
+        if first_only and found:
+            # every synset closer than the depth of the layers is in them
+            closest = min(found.itervalues())
+            found = dict((dst, dist) for dst, dist in found.iteritems() if dist == closest)
+        elif remaining and layers.frontier and layers.depth < max_dist:
+            expanded = True
+            n_added = 0
+            while remaining and layers.frontier and layers.depth < max_dist:
+                layers.depth += 1
+                nodes = expand(set(encode(s) for s in layers.frontier))
+                layers.frontier = set(s for s in (decode(n) for n in nodes) if s not in dists)
+                for s in layers.frontier:
+                    dists[s] = layers.depth
+                n_added += len(layers.frontier)
+                hit = remaining & layers.frontier
+                if hit:
+                    remaining -= hit
+                    for dst in hit:
+                        found[dst] = layers.depth
+                    if first_only:
+                        break
+            self.cache.grew(n_added)
+        if cached and expanded:
+            self.cache.resumes += 1
+        elif cached:
+            self.cache.hits += 1
+        if first_only and found:
+            return found, False
+
+        # like _search, cut off when dsts are left and the level at max_dist was not empty, which it
+        # was not if an earlier search went deeper
+        left = remaining or any(dists.get(dst, 0) > max_dist for dst in dsts)
+        return found, bool(left and (layers.depth > max_dist or layers.frontier))
+
+    def get_dist(self, src, dst, link_typ="", max_dist=12):
+        """ Bidirectional search for the distance between two synsets
+
+            Return:
+                number of links between src and dst, -1 if it is more than max_dist
+        """
         if dst == src:
             return 0
-        to_see = Queue()
-        to_see.put((src, 0))
-        seen = set()
-        while not to_see.empty():
-            current, dist = to_see.get()
-            connected = self.get_linked_synsets(current, link_typ)
-            connected = connected - seen
-            seen |= connected
-            if dst in connected:
-                return dist + 1
-            for synsetid in connected:
-                to_see.put((synsetid, dist + 1))
+        bounds = self._oracle_bounds(src, dst, link_typ)
+        if bounds is not None:
+            lower, _, exact = bounds
+            if lower > max_dist or (exact and lower == -1):
+                return -1
+            if exact:
+                return lower
+        expand, encode, _ = self._search_space(link_typ)
+        a, b = encode(src), encode(dst)
+        if a is None or b is None:
+            return -1
+        dists_a, dists_b = {a: 0}, {b: 0}
+        frontier_a, frontier_b = set([a]), set([b])
+        depth_a = depth_b = 0
+        while frontier_a and frontier_b and depth_a + depth_b < max_dist:
+            # grow the smaller side, a meeting node gives the shortest path through it
+            if len(frontier_a) > len(frontier_b):
+                dists_a, dists_b = dists_b, dists_a
+                frontier_a, frontier_b = frontier_b, frontier_a
+                depth_a, depth_b = depth_b, depth_a
+            depth_a += 1
+            frontier_a = set(n for n in expand(frontier_a) if n not in dists_a)
+            meet = [dists_b[n] for n in frontier_a if n in dists_b]
+            if meet:
+                return depth_a + min(meet)
+            for n in frontier_a:
+                dists_a[n] = depth_a
 
         return -1
 
     def get_min_dist_to_set(self, src, dst, link_typ="", max_dist=12):
-        if dst == src:
-            return 0
-        to_see = Queue()
-        to_see.put((src, 0))
-        seen = set()
-        while not to_see.empty():
-            current, dist = to_see.get()
-            connected = self.get_linked_synsets(current, link_typ)
-            connected = connected - seen
-            seen |= connected
-            if dst & connected:
-                return dist + 1
-            for synsetid in connected:
-                to_see.put((synsetid, dist + 1))
-
+        """ Return:
+                distance from src to the closest synset in dst, max_dist if none is within max_dist
+        """
+        found, _ = self._search(src, dst, link_typ, max_dist, first_only=True)
+        if found:
+            return min(found.itervalues())
         return max_dist
     
     def get_dists(self, src, dsts, link_typ="", max_dist=12):
-        
-        dists = dict()
-        if src in dsts:
-            dists[src] = 0
-            dsts -= set([src])
-        to_see = Queue()
-        to_see.put((src, 0))
-        seen = set()
-        while not to_see.empty() and dsts:
-            current, dist = to_see.get()
-            if dist == max_dist:
-                for dst in dsts:
+        """ Return:
+                dict of distances from src to each synset in dsts. dsts further than max_dist get
+                max_dist, dsts not connected to src at all are left out
+        """
+        known = dict()
+        if self.get_linkids(link_typ) in self._oracles:
+            unknown = set()
+            for dst in dsts:
+                lower, _, exact = self._oracle_bounds(src, dst, link_typ)
+                if exact and lower == -1:
+                    continue
+                if exact or lower > max_dist:
+                    known[dst] = min(lower, max_dist)
+                else:
+                    unknown.add(dst)
+            if not unknown:
+                return known
+            dsts = unknown
+        dists, cut_off = self._search(src, dsts, link_typ, max_dist)
+        if cut_off:
+            for dst in dsts:
+                if dst not in dists:
                     dists[dst] = max_dist
-                break
-            connected = self.get_linked_synsets(current, link_typ)
-            connected = connected - seen
-            seen |= connected
-            found = dsts & connected
-            dsts -= found
-            if found:
-                for s in found:
-                    dists[s] = dist + 1
-            for synsetid in connected:
-                to_see.put((synsetid, dist + 1))
-
+        dists.update(known)
         return dists
 
     def get_senses(self, word, pos=""):
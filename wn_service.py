@@ -0,0 +1,215 @@
+import sys, time, json, glob, socket, asyncore, asynchat
+import numpy as np
+from wn_searching import Wn_Searchable
+from synset import get_registry
+from synset_matrix import Synset_Matrix
+from set_extension import iter_top_n
+from proposal_state import Proposal_State, state_fname
+
+PORT = 7347
+
+
+class _Connection(asynchat.async_chat):
+    """ one client connection, requests and responses are json objects, one per line """
+
+    def __init__(self, sock, service):
+        asynchat.async_chat.__init__(self, sock, map=service.socket_map)
+        self.service = service
+        self.buffer = []
+        self.set_terminator("\n")
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        line = "".join(self.buffer)
+        self.buffer = []
+        if line.strip():
+            self.service.pending.append((self, line))
+
+    def respond(self, response):
+        self.push(json.dumps(response) + "\n")
+
+
+class Wn_Service(asyncore.dispatcher):
+    """ A local server that keeps a Wn_Searchable (with its graph), the synset vectors and the
+        link proposals loaded, and answers queries over a socket
+
+    Requests are json lines {"id": ..., "op": ..., "args": {...}} and are answered in order with
+    {"id": ..., "result": ...} or {"id": ..., "error": ...}. Requests that arrive together, from any
+    client, are handled as one batch, so the nearest queries of a batch are scored with one matrix
+    multiply per pos. The ops are:
+        senses     {"word"} the sense keys of a word
+        synsetids  {"word"} the synsetids of a word
+        dist       {"src", "dst", "link_typ", "max_dist"} Wn_Searchable.get_dist
+        dists      {"src", "dsts", "link_typ", "max_dist"} Wn_Searchable.get_dists as [dst, dist] pairs
+        nearest    {"synsetid", "pos", "n"} the n synsets of pos whose vectors are most similar
+        proposals  {"link", "pos_from", "pos_to", "synsetid", "direction"} the learn_new_links
+                   proposals of a synset, "direction" is "to" (default) or "from", for the
+                   Proposal_States loaded at startup
+        stats      counters of the service
+
+    Python 2 has no asyncio, so the event loop is asyncore and asynchat
+
+    Args:
+        wn_fname (str): the file name of the sql WordNet
+        matrix_fname (str): prefix of a saved Synset_Matrix of the synsets
+        port (int, optional): port to listen on, on localhost only
+        state_prefix (str, optional): prefix of saved Proposal_States, all of them are loaded at startup
+        proposal_keys (list of tuple, optional): (link, pos_from, pos_to) of the Proposal_States to
+            load or, if none is saved, build (and save under state_prefix) at startup
+    """
+
+    def __init__(self, wn_fname, matrix_fname, port=PORT, state_prefix=None, proposal_keys=()):
+        self.socket_map = dict()
+        asyncore.dispatcher.__init__(self, map=self.socket_map)
+        start = time.time()
+        self.wn_fname = wn_fname
+        self.wn = Wn_Searchable(wn_fname, use_graph=True)
+        self.matrix = Synset_Matrix.load(matrix_fname)
+        self.state_prefix = state_prefix
+        self.states = dict() # (link, pos_from, pos_to) -> Proposal_State
+        self.candidates = dict() # pos -> (synsetids, unit vectors) of the covered synsets of pos
+        registry = get_registry(wn_fname)
+        for pos in ["n", "v", "a", "s"]:
+            rows = [self.matrix.row(s.synsetid) for s in registry.by_pos(pos, lazy=True) if self.matrix.covers(s.synsetid)]
+            rows = np.array(sorted(rows), dtype=np.int64)
+            vectors = np.array(self.matrix.vectors[rows], dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)[:, np.newaxis]
+            self.candidates[pos] = (self.matrix.synsetids[rows], vectors)
+        self.load_states(proposal_keys)
+        self.load_time = time.time() - start
+
+        self.pending = []
+        self.n_requests = self.n_batches = self.n_errors = 0
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(("127.0.0.1", port))
+        self.listen(64)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _Connection(pair[0], self)
+
+    def serve_forever(self, poll_timeout=0.005):
+        while True:
+            asyncore.loop(timeout=poll_timeout, map=self.socket_map, count=1)
+            if self.pending:
+                self.handle_batch()
+
+    def handle_batch(self):
+        batch, self.pending = self.pending, []
+        self.n_batches += 1
+        requests = []
+        for connection, line in batch:
+            try:
+                request = json.loads(line)
+                requests.append((connection, request.get("id"), request["op"], request.get("args", {})))
+            except Exception as e:
+                connection.respond({"id": None, "error": "bad request: %s" % e})
+                self.n_errors += 1
+
+        results = dict()
+        nearest = [i for i, r in enumerate(requests) if r[2] == "nearest"]
+        if nearest:
+            try:
+                results.update(self.nearest([requests[i][3] for i in nearest], nearest))
+            except Exception as e:
+                for i in nearest:
+                    results[i] = e
+        for i, (_, _, op, args) in enumerate(requests):
+            if op == "nearest":
+                continue
+            try:
+                results[i] = self.answer(op, args)
+            except Exception as e:
+                results[i] = e
+
+        for i, (connection, request_id, _, _) in enumerate(requests):
+            self.n_requests += 1
+            if isinstance(results[i], Exception):
+                self.n_errors += 1
+                connection.respond({"id": request_id, "error": str(results[i])})
+            else:
+                connection.respond({"id": request_id, "result": results[i]})
+
+    def answer(self, op, args):
+        if op == "senses":
+            return self.wn.get_senses(args["word"])
+        if op == "synsetids":
+            return sorted(self.wn.get_synsetids(args["word"]))
+        if op == "dist":
+            return self.wn.get_dist(args["src"], args["dst"], args.get("link_typ", ""), args.get("max_dist", 12))
+        if op == "dists":
+            dists = self.wn.get_dists(args["src"], set(args["dsts"]), args.get("link_typ", ""), args.get("max_dist", 12))
+            return sorted(dists.iteritems())
+        if op == "proposals":
+            state = self.proposal_state(args["link"], args["pos_from"], args["pos_to"])
+            return state.proposals[args.get("direction", "to")].get(args["synsetid"], [])
+        if op == "stats":
+            return {"requests": self.n_requests, "batches": self.n_batches, "errors": self.n_errors,
+                    "load_time": self.load_time, "connections": len(self.socket_map) - 1}
+        raise Exception("no such op: %s" % op)
+
+    def nearest(self, requests, keys):
+        """ the nearest queries of a batch, one iter_top_n per (pos, n)
+
+        Returns:
+            dict of key -> list of (synsetid, sim), or the exception for bad requests
+        """
+        results = dict()
+        groups = dict()
+        for key, args in zip(keys, requests):
+            if not self.matrix.covers(args["synsetid"]) or args.get("pos", "n") not in self.candidates:
+                results[key] = Exception("no vector for %s or no such pos" % args["synsetid"])
+                continue
+            groups.setdefault((args.get("pos", "n"), args.get("n", 15)), []).append((key, args["synsetid"]))
+        for (pos, n), group in groups.iteritems():
+            candidate_ids, candidates = self.candidates[pos]
+            queries = np.array([self.matrix.vector(sid) for _, sid in group], dtype=np.float32)
+            exclude = [set([sid]) for _, sid in group]
+            for (key, _), row in zip(group, iter_top_n(queries, exclude, candidate_ids, candidates, n)):
+                results[key] = [(sid, sim) for sid, sim in row if sid != "000"]
+        return results
+
+    def load_states(self, keys=()):
+        """ Loads every Proposal_State saved under state_prefix, then loads or builds (and saves) the
+            ones of keys that are still missing, so no query ever waits for a state to be built
+
+        Args:
+            keys (list of tuple): (link, pos_from, pos_to) of the states to have
+        """
+        if self.state_prefix:
+            for fname in sorted(glob.glob(self.state_prefix + ".*.state")):
+                state = Proposal_State.load(fname)
+                self.states[(state.link, state.pos_from, state.pos_to)] = state
+        for link, pos_from, pos_to in keys:
+            key = (link, pos_from, pos_to)
+            if key in self.states:
+                continue
+            self.states[key] = Proposal_State.build(link, pos_from, pos_to, self.wn_fname, self.matrix)
+            if self.state_prefix:
+                self.states[key].save(state_fname(self.state_prefix, link, pos_from, pos_to))
+
+    def proposal_state(self, link, pos_from, pos_to):
+        state = self.states.get((link, pos_from, pos_to))
+        if state is None:
+            raise Exception("no proposals loaded for %s %s-%s" % (link, pos_from, pos_to))
+        return state
+
+
+def main(args):
+    """ wn_service.py <wn file> <matrix prefix> [port] [proposal state prefix] [link:pos_from:pos_to...]
+
+    loads every proposal state saved under the prefix, and builds the ones given that are not saved
+    """
+    port = int(args[2]) if len(args) > 2 else PORT
+    keys = [tuple(key.rsplit(":", 2)) for key in args[4:]]
+    service = Wn_Service(args[0], args[1], port, args[3] if len(args) > 3 else None, keys)
+    print "loaded in %.1fs, listening on 127.0.0.1:%d" % (service.load_time, port)
+    sys.stdout.flush()
+    service.serve_forever()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,167 @@
+import sqlite3, sys, os
+from urllib import pathname2url
+from profiling import connection_factory
+
+MMAP_SIZE = 1 << 30 # map up to 1 GB of the database file instead of reading it through the page cache
+CACHE_KIB = 256 * 1024 # 256 MB page cache
+CACHED_STATEMENTS = 256 # prepared statements kept per connection, IN (...) queries of each chunk size count separately
+
+# covering indexes for the point lookups made by Synset, Wn_Searchable and get_links
+INDEXES = [
+    ("perf_senses_synsetid", "senses", ["synsetid", "old_sensekey", "wordid"]),
+    ("perf_senses_wordid", "senses", ["wordid", "synsetid"]),
+    ("perf_senses_old_sensekey", "senses", ["old_sensekey", "synsetid"]),
+    ("perf_semlinks_synset1id", "semlinks", ["synset1id", "linkid", "synset2id"]),
+    ("perf_semlinks_synset2id", "semlinks", ["synset2id", "linkid", "synset1id"]),
+    ("perf_semlinks_linkid", "semlinks", ["linkid", "synset1id", "synset2id"]),
+    ("perf_morphs_morph", "morphs", ["morph", "morphid"]),
+    ("perf_morphmaps_morphid", "morphmaps", ["morphid", "wordid"]),
+    ("perf_words_lemma", "words", ["lemma", "wordid"]),
+    ("perf_synsets_pos", "synsets", ["pos", "synsetid"]),
+]
+
+# the hot queries, with example parameters for their query plans
+HOT_QUERIES = [
+    ("SELECT old_sensekey, wordid FROM senses WHERE synsetid=?", (0,)),
+    ("SELECT count(1) FROM senses WHERE wordid=?", (0,)),
+    ("SELECT synsetid FROM senses WHERE old_sensekey=?", ("",)),
+    ("SELECT synset2id FROM semlinks WHERE synset1id=?", (0,)),
+    ("SELECT synset1id FROM semlinks WHERE synset2id=?", (0,)),
+    ("SELECT synset2id FROM semlinks WHERE synset1id=? AND linkid IN (?)", (0, 0)),
+    ("SELECT synset1id, synset2id FROM semlinks WHERE linkid=?", (0,)),
+    ("SELECT synsetid FROM senses WHERE wordid IN (SELECT wordid FROM morphmaps WHERE morphid IN "
+            "(SELECT morphid FROM morphs WHERE morph=?) UNION ALL SELECT wordid FROM words WHERE lemma=?)", ("", "")),
+    ("SELECT synsetid, definition FROM synsets WHERE pos=?", ("n",)),
+]
+
+class Counting_Cursor(object):
+    """ Wraps a sqlite cursor and counts the statements executed through it
+
+    Args:
+        cursor (sqlite cursor): the cursor to wrap
+
+    Attributes:
+        n_queries (int): statements executed so far
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.n_queries = 0
+
+    def execute(self, *args):
+        self.n_queries += 1
+        self.cursor.execute(*args)
+        return self
+
+    def executemany(self, *args):
+        self.n_queries += 1
+        self.cursor.executemany(*args)
+        return self
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+_uri_support = []
+
+def _supports_uri():
+    """ whether sqlite was built to understand file: uris, otherwise they would be taken as file names """
+    if not _uri_support:
+        options = sqlite3.connect(":memory:").execute("PRAGMA compile_options").fetchall()
+        _uri_support.append(any(o[0] == "USE_URI" for o in options))
+    return _uri_support[0]
+
+def connect(wn_fname, read_only=True):
+    """ Opens the WordNet database for fast read only point lookups
+
+    Read only connections open the file as immutable when sqlite supports uris, which skips all
+    locking and change detection, so the file must not be modified while it is open. Every connection
+    memory maps the file, gets a large page cache and keeps more prepared statements. While profiling
+    is enabled the connection records its queries.
+
+    Args:
+        wn_fname (str): the file name of the sql WordNet
+        read_only (bool, optional): open read only, False for tools that change the database
+
+    Returns:
+        sqlite3 connection
+    """
+    if read_only and _supports_uri():
+        if not os.path.exists(wn_fname):
+            raise Exception("no such WordNet database: %s" % wn_fname)
+        uri = "file:%s?mode=ro&immutable=1" % pathname2url(os.path.abspath(wn_fname))
+        con = sqlite3.connect(uri, cached_statements=CACHED_STATEMENTS, factory=connection_factory())
+    else:
+        con = sqlite3.connect(wn_fname, cached_statements=CACHED_STATEMENTS, factory=connection_factory())
+        if read_only:
+            con.execute("PRAGMA query_only=1")
+    con.execute("PRAGMA mmap_size=%d" % MMAP_SIZE)
+    con.execute("PRAGMA cache_size=-%d" % CACHE_KIB)
+    con.execute("PRAGMA temp_store=MEMORY")
+    return con
+
+def query_plans(con):
+    """ EXPLAIN QUERY PLAN of every hot query
+
+    Returns:
+        list of (query, list of plan details)
+    """
+    plans = []
+    for query, params in HOT_QUERIES:
+        rows = con.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+        plans.append((query, [row[-1] for row in rows]))
+    return plans
+
+def missing_indexes(con):
+    """ the INDEXES whose columns are not the leading columns of an existing index """
+    missing = []
+    for name, table, columns in INDEXES:
+        existing = []
+        for row in con.execute("PRAGMA index_list(%s)" % table).fetchall():
+            info = con.execute("PRAGMA index_info(%s)" % row[1]).fetchall()
+            existing.append([col[2] for col in sorted(info)])
+        if not any(cols[:len(columns)] == columns for cols in existing):
+            missing.append((name, table, columns))
+    return missing
+
+def provision_indexes(wn_fname, create=False):
+    """ Verifies, and optionally creates, the covering indexes of the hot queries
+
+    Prints the query plans before and after, and the indexes that are missing or were created
+
+    Args:
+        wn_fname (str): the file name of the sql WordNet
+        create (bool, optional): create the missing indexes
+
+    Returns:
+        list of (name, table, columns) of the indexes that are (or were) missing
+    """
+    con = connect(wn_fname, read_only=False)
+    print "query plans before:"
+    for query, details in query_plans(con):
+        print "  %s\n    %s" % (query, "\n    ".join(details))
+
+    missing = missing_indexes(con)
+    for name, table, columns in missing:
+        print "missing index %s on %s(%s)" % (name, table, ", ".join(columns))
+    if not missing:
+        print "all indexes present"
+    elif create:
+        for name, table, columns in missing:
+            con.execute("CREATE INDEX IF NOT EXISTS %s ON %s(%s)" % (name, table, ", ".join(columns)))
+        con.execute("ANALYZE")
+        con.commit()
+        print "query plans after:"
+        for query, details in query_plans(con):
+            print "  %s\n    %s" % (query, "\n    ".join(details))
+    con.close()
+    return missing
+
+
+def main(args):
+    provision_indexes(args[0], create="--create" in args[1:])
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
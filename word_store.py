@@ -0,0 +1,134 @@
+import sys, os, io, time
+import numpy as np
+from synset_matrix import Synset_Matrix
+from wn_sql import connect
+
+
+class Word_Vectors:
+    """ Word vectors stored as a memory mapped float32 matrix
+
+    Drop in replacement for the gensim KeyedVectors used by Synset.vectorize1 and Synset.words_in.
+    Saved as <fname>.npy (one row per word) and <fname>.vocab (one word per line, in row order).
+    Since the matrix is memory mapped, processes loading the same store share its pages instead of
+    each holding a private copy.
+
+    Args:
+        words (list of unicode): word of each row
+        vectors (np.array of float32): one row per word
+
+    Attributes:
+        vocab (dict): word to row
+    """
+
+    def __init__(self, words, vectors):
+        self.words = words
+        self.vectors = vectors
+        self.vocab = dict((w, i) for i, w in enumerate(words))
+
+    @classmethod
+    def load(cls, fname, mmap=True):
+        vectors = np.load(fname + ".npy", mmap_mode="r" if mmap else None)
+        with io.open(fname + ".vocab", encoding="utf8") as f:
+            words = f.read().split("\n")[:len(vectors)]
+        return cls(words, vectors)
+
+    def __getitem__(self, word):
+        return self.vectors[self.vocab[word]]
+
+    def __contains__(self, word):
+        return word in self.vocab
+
+    def __len__(self):
+        return len(self.words)
+
+
+def wordnet_words(wn_fname):
+    """ Every form Synset.words can take, lemmas with spaces or underscores and sense key words
+
+    Args:
+        wn_fname (str): the file name of the sql WordNet
+
+    Returns:
+        set of unicode words
+    """
+    con = connect(wn_fname)
+    wn_db = con.cursor()
+    words = set()
+    wn_db.execute("SELECT lemma FROM words")
+    for lemma, in wn_db.fetchall():
+        words.add(lemma)
+        words.add(lemma.replace(" ", "_"))
+    wn_db.execute("SELECT old_sensekey FROM senses")
+    for sensekey, in wn_db.fetchall():
+        words.add(sensekey.split("%")[0])
+    return words
+
+def convert_word2vec(bin_fname, out_fname, keep=None):
+    """ Converts a binary word2vec file (like GoogleNews-vectors-negative300.bin) to a Word_Vectors store
+
+    The file is streamed, so the full model is never held in memory.
+
+    Args:
+        bin_fname (str): binary word2vec file
+        out_fname (str): file name prefix of the store
+        keep (set of unicode, optional): only keep these words
+
+    Returns:
+        number of words stored
+    """
+    tmp_fname = out_fname + ".tmp.npy"
+    with open(bin_fname, "rb") as f:
+        count, dim = map(int, f.readline().split())
+        rows = np.lib.format.open_memmap(tmp_fname, mode="w+", dtype=np.float32, shape=(count, dim))
+        row_bytes = dim * np.dtype(np.float32).itemsize
+        words = []
+        for _ in xrange(count):
+            chars = []
+            while True:
+                c = f.read(1)
+                if c == b" " or c == b"":
+                    break
+                if c != b"\n": # entries may be separated by newlines
+                    chars.append(c)
+            word = b"".join(chars).decode("utf8", "ignore")
+            vector = np.frombuffer(f.read(row_bytes), dtype=np.float32)
+            if keep is None or word in keep:
+                rows[len(words)] = vector
+                words.append(word)
+
+    stored = np.lib.format.open_memmap(out_fname + ".npy", mode="w+", dtype=np.float32, shape=(len(words), dim))
+    stored[:] = rows[:len(words)]
+    stored.flush()
+    del rows, stored
+    os.remove(tmp_fname)
+    with io.open(out_fname + ".vocab", "w", encoding="utf8") as f:
+        f.write(u"\n".join(words))
+    return len(words)
+
+def load_word_vectors(fname):
+    """ Loads vectors from a binary word2vec file with gensim, a Word_Vectors store or a Synset_Matrix
+
+    Args:
+        fname (str): a .bin word2vec file or the prefix a store or matrix was saved with
+
+    Returns:
+        gensim.KeyedVectors, Word_Vectors or Synset_Matrix
+    """
+    if fname.endswith(".bin"):
+        import gensim
+        model = gensim.models.KeyedVectors.load_word2vec_format(fname, binary=True)
+        return model.wv
+    if os.path.exists(fname + ".ids.npy"):
+        return Synset_Matrix.load(fname)
+    return Word_Vectors.load(fname)
+
+
+def main(args):
+    bin_fname, out_fname = args[0], args[1]
+    keep = wordnet_words(args[2]) if len(args) > 2 else None
+    start = time.time()
+    n = convert_word2vec(bin_fname, out_fname, keep)
+    print "%d words stored in %.1fs" % (n, time.time() - start)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
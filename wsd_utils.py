@@ -1,7 +1,14 @@
+import sys, time, json, platform
 import random as rand
+import multiprocessing
 from wn_searching import Wn_Searchable
+from wn_sql import Counting_Cursor
+from bfs_cache import Bfs_Cache
+import profiling
+import synset
 
 WN_FILE = "wordnet_3.1+.db"
+TESTCASES_FILE = "testcases"
 
 class WsdTestResults:
 
@@ -44,6 +51,26 @@ class WsdTestResults:
             dif_mins.append(min_incorrect - min_correct)
         return dif_mins
 
+# per process state of the evaluation workers, set by _init_worker
+_worker = dict()
+
+def _init_worker(wn_fname, use_graph, cache_size, predict_function, args):
+    # registries inherited over fork() share the parent's sqlite connection,
+    # so every worker opens its own
+    synset._REGISTRIES.clear()
+    cache = Bfs_Cache(cache_size) if cache_size else None
+    _worker["wn"] = Wn_Searchable(wn_fname, use_graph=use_graph, cache=cache)
+    _worker["predict_function"] = predict_function
+    _worker["args"] = args
+
+def _predict_shard(shard):
+    predict_function, args, wn = _worker["predict_function"], _worker["args"], _worker["wn"]
+    return [predict_function(c, t, o, wn, args) for c, t, o in shard]
+
+def _percentile(values, p):
+    """ nearest rank percentile of sorted values """
+    return values[max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))]
+
 POS_MAP = {
     "NOUN": "%1:",
     "VERB": "%2:",
@@ -53,8 +80,8 @@ POS_MAP = {
 
 class WsdTester:
 
-    def __init__(self, n=0):
-        test_cases = open("testcases").read().splitlines()
+    def __init__(self, n=0, use_graph=False, cache=None, wn_fname=WN_FILE, testcases_fname=TESTCASES_FILE):
+        test_cases = open(testcases_fname).read().splitlines()
 
         # parse testcases document
         def parse(test):
@@ -65,7 +92,9 @@ class WsdTester:
             return (context, target, args[1:l-1], POS_MAP.get(args[l-1], "NONE"))
         test_cases = map(parse, test_cases)
         
-        self.wn = Wn_Searchable(WN_FILE)
+        self.use_graph = use_graph
+        self.wn_fname = wn_fname
+        self.wn = Wn_Searchable(wn_fname, use_graph=use_graph, cache=cache)
 
         # use wn to get possible sense options to choose from
         test_cases = [(c, t, a, filter(lambda s: pos in s, self.wn.get_senses(t))) for c, t, a, pos in test_cases]
@@ -80,14 +109,103 @@ class WsdTester:
 
         self.contexts, self.targets, self.answers, self.options = zip(*test_cases)
         
-    def test(self, predict_function, args):
+    def test(self, predict_function, args, processes=1):
+        """ Scores every test case with predict_function
 
-        # use prediction function on all test cases
-        scores = [predict_function(c, t, o, self.wn, args) for c, t, o in zip(self.contexts, self.targets, self.options)]
+        With more than one process the test cases are split into shards spread over a process pool,
+        every worker opening its own Wn_Searchable (and graph). The scores are merged back in test
+        case order, so the results are the same as a serial run for deterministic predict functions.
+        If the tester has a Bfs_Cache every worker gets an empty one of the same size.
+        predict_function and args are pickled to the workers, so predict_function must be defined at
+        module level.
+
+        Args:
+            predict_function (function): takes (context, target, options, wn, args) and returns a score per option
+            args: passed on to predict_function
+            processes (int, optional): number of worker processes, None for one per cpu
+
+        Returns:
+            WsdTestResults
+        """
+        test_cases = zip(self.contexts, self.targets, self.options)
+        if processes == 1:
+            # use prediction function on all test cases
+            with profiling.timer("WsdTester.test %s" % predict_function.__name__):
+                scores = [predict_function(c, t, o, self.wn, args) for c, t, o in test_cases]
+        else:
+            processes = processes or multiprocessing.cpu_count()
+            # several shards per worker so a slow shard does not hold up the others
+            shard_size = max(1, len(test_cases) // (processes * 4))
+            shards = [test_cases[i:i + shard_size] for i in xrange(0, len(test_cases), shard_size)]
+            cache_size = self.wn.cache.max_nodes if self.wn.cache is not None else 0
+            pool = multiprocessing.Pool(processes, _init_worker,
+                    (self.wn_fname, self.use_graph, cache_size, predict_function, args))
+            try:
+                scores = [s for shard_scores in pool.imap(_predict_shard, shards) for s in shard_scores]
+            finally:
+                pool.terminate()
+                pool.join()
 
         # return prediction result
         return WsdTestResults(scores, self.options, self.answers)
 
+    def benchmark(self, predictors, out_fname=None):
+        """ Times every predictor case by case
+
+        Each predictor runs serially on a fresh Wn_Searchable (with a fresh cache if the tester has one),
+        so memoized lookups of one predictor do not speed up the next
+
+        Args:
+            predictors (list of tuple): (name, predict_function, args) like PREDICTORS
+            out_fname (str, optional): file to write the report to as json
+
+        Returns:
+            dict with the settings of the run and a report per predictor: accuracy, latency
+            percentiles in ms, cases per second, sql queries and synsets expanded by searches
+        """
+        report = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "wn_file": self.wn_fname,
+            "use_graph": self.use_graph,
+            "cache_size": self.wn.cache.max_nodes if self.wn.cache is not None else 0,
+            "n_cases": len(self.targets),
+            "predictors": dict(),
+        }
+        for name, predict_function, args in predictors:
+            cache = Bfs_Cache(report["cache_size"]) if report["cache_size"] else None
+            wn = Wn_Searchable(self.wn_fname, use_graph=self.use_graph, cache=cache)
+            wn.wn_db = Counting_Cursor(wn.wn_db)
+            wn.registry.wn_db = registry_db = Counting_Cursor(wn.registry.wn_db)
+
+            scores, latencies = [], []
+            start = time.time()
+            for c, t, o in zip(self.contexts, self.targets, self.options):
+                case_start = time.time()
+                scores.append(predict_function(c, t, o, wn, args))
+                latencies.append(time.time() - case_start)
+            seconds = time.time() - start
+            wn.registry.wn_db = registry_db.cursor
+
+            latencies.sort()
+            n_queries = wn.wn_db.n_queries + registry_db.n_queries
+            report["predictors"][name] = {
+                "accuracy": WsdTestResults(scores, self.options, self.answers).accuracy,
+                "seconds": seconds,
+                "cases_per_second": len(scores) / seconds if seconds > 0 else None,
+                "latency_ms": dict(("p%d" % p, 1000 * _percentile(latencies, p)) for p in (50, 90, 99)),
+                "max_latency_ms": 1000 * latencies[-1],
+                "sql_queries": n_queries,
+                "sql_queries_per_case": float(n_queries) / len(scores),
+                "nodes_expanded": wn.n_expanded,
+                "cache": cache.stats() if cache is not None else None,
+            }
+
+        if out_fname is not None:
+            with open(out_fname, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        return report
+
     def print_tests(self):
         for t, o, a in zip(self.targets, self.options, self.answers):
             print "%s: %s FROM %s" % (t, ", ".join(a), ", ".join(o))
@@ -118,10 +236,59 @@ def h2(context, target, options, wn, args):
     
     return scores
 
+def h1_batched(context, target, options, wn, args):
+    """ same scores as h1 from one search shared by all options """
+    context_synsets = [wn.get_synsetids(w) for w in context]
+    all_context_synsets = reduce(lambda s, x: x | s, context_synsets)
 
-if __name__ == "__main__":
-    tester = WsdTester(100)
-    print "random baseline accuracy: %2.1f%%" % (tester.test(random_baseline, None).accuracy * 100)
-    print "shortest distance accuracy: %2.1f%%" % (tester.test(shortest_distance, [simple_scoring_function]).accuracy * 100)
+    synsetids = [wn.get_synsetid_from_sensekey(option) for option in options]
+    dists_maps = wn.get_dists_multi(synsetids, all_context_synsets)
+    return [sum(min([12] + [dists_map.get(sid, 12) for sid in s]) for s in context_synsets) for dists_map in dists_maps]
+
+def h2_batched(context, target, options, wn, args):
+    """ same scores as h2 from one search shared by all options """
+    context_synsets = [wn.get_synsetids(w) for w in context]
+    all_context_synsets = reduce(lambda s, x: x | s, context_synsets)
+
+    synsetids = [wn.get_synsetid_from_sensekey(option) for option in options]
+    return wn.get_min_dists_to_set(synsetids, all_context_synsets)
 
-    
\ No newline at end of file
+
+# predictors run by the benchmark, (name, predict_function, args)
+PREDICTORS = [
+    ("random_baseline", random_baseline, None),
+    ("h1", h1, None),
+    ("h2", h2, None),
+    ("h1_batched", h1_batched, None),
+    ("h2_batched", h2_batched, None),
+]
+
+def main(args):
+    """ wsd_utils.py [n cases] [benchmark.json] [--graph]
+
+    prints the accuracy of every predictor, or with a json file name benchmarks them and writes the report to it,
+    set WN_PROFILE to a json file name to profile the run
+    """
+    profiling.enable_from_env()
+    use_graph = "--graph" in args
+    args = [a for a in args if not a.startswith("--")]
+    tester = WsdTester(int(args[0]) if args else 100, use_graph=use_graph)
+    if len(args) < 2:
+        for name, predict_function, predict_args in PREDICTORS:
+            print "%s accuracy: %2.1f%%" % (name, tester.test(predict_function, predict_args).accuracy * 100)
+        profiling.finish()
+        return
+
+    report = tester.benchmark(PREDICTORS, args[1])
+    print "%d cases, graph %s" % (report["n_cases"], use_graph)
+    print "%-16s %8s %8s %8s %8s %10s %10s %12s" % (
+            "predictor", "accuracy", "p50 ms", "p90 ms", "p99 ms", "cases/s", "queries", "expanded")
+    for name, _, _ in PREDICTORS:
+        r = report["predictors"][name]
+        print "%-16s %7.1f%% %8.2f %8.2f %8.2f %10.1f %10d %12d" % (name, r["accuracy"] * 100,
+                r["latency_ms"]["p50"], r["latency_ms"]["p90"], r["latency_ms"]["p99"],
+                r["cases_per_second"] or 0, r["sql_queries"], r["nodes_expanded"])
+    profiling.finish()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])